@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+from .auth_utils import SECRET_KEY
+
+# One-time codes (registration OTPs, password reset tokens) live in the auth_tokens table, one row
+# per user and purpose, instead of as nullable columns on every user. Only an HMAC of the code is
+# stored: a plain hash of a six digit OTP could be reversed by trying all million codes. A code is
+# consumed with a single DELETE ... RETURNING, so it can be used once, and replaced with an upsert on
+# (user_id, purpose), so two concurrent requests for a code cannot collide. Expired rows are removed by
+# the TokenSweeper in bounded batches, keyed on the expires_at index.
+OTP_PURPOSE = "otp"
+PASSWORD_RESET_PURPOSE = "password_reset"
+
+OTP_TTL = timedelta(minutes=10)
+PASSWORD_RESET_TTL = timedelta(hours=1)
+
+AUTH_TOKEN_SWEEP_SECONDS = float(os.getenv("AUTH_TOKEN_SWEEP_SECONDS", 300))
+AUTH_TOKEN_SWEEP_BATCH_SIZE = int(os.getenv("AUTH_TOKEN_SWEEP_BATCH_SIZE", 500))
+
+def hash_code(code: str) -> str:
+    return hmac.new(SECRET_KEY.encode(), code.encode(), hashlib.sha256).hexdigest()
+
+async def issue(db: AsyncSession, user_id: int, purpose: str, code: str, ttl: timedelta):
+    """Store a new code for a user, replacing the previous one. The caller commits."""
+    statement = database.dialect_insert(db, models.AuthToken).values(
+        user_id=user_id, purpose=purpose, code_hash=hash_code(code), expires_at=datetime.utcnow() + ttl
+    )
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[models.AuthToken.user_id, models.AuthToken.purpose],
+        set_={"code_hash": statement.excluded.code_hash, "expires_at": statement.excluded.expires_at},
+    ))
+
+async def consume(db: AsyncSession, user_id: int, purpose: str, code: str) -> bool:
+    """Delete the user's code if it matches and has not expired. Returns whether it did. The caller commits."""
+    consumed = (await db.execute(
+        delete(models.AuthToken)
+        .where(
+            models.AuthToken.user_id == user_id,
+            models.AuthToken.purpose == purpose,
+            models.AuthToken.code_hash == hash_code(code),
+            models.AuthToken.expires_at >= datetime.utcnow(),
+        )
+        .returning(models.AuthToken.id)
+    )).first()
+    return consumed is not None
+
+async def sweep_expired(batch_size: int = AUTH_TOKEN_SWEEP_BATCH_SIZE) -> int:
+    """Delete expired codes, batch_size rows per transaction. Returns how many were deleted."""
+    deleted = 0
+    while True:
+        async with database.AsyncSessionLocal() as db:
+            expired = select(models.AuthToken.id).where(models.AuthToken.expires_at < datetime.utcnow()).limit(batch_size)
+            ids: List[int] = (await db.execute(
+                delete(models.AuthToken).where(models.AuthToken.id.in_(expired)).returning(models.AuthToken.id)
+            )).scalars().all()
+            await db.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+        await asyncio.sleep(0) # Let requests waiting for the database go first
+
+class TokenSweeper:
+    """Background task that periodically deletes expired auth tokens."""
+
+    def __init__(self, interval: float = AUTH_TOKEN_SWEEP_SECONDS):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await sweep_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Auth token sweeper error: {e}")
+            await asyncio.sleep(self.interval)
+
+sweeper = TokenSweeper()
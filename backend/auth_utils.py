@@ -1,30 +1,161 @@
+import asyncio
+import multiprocessing
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 
-from . import database, models
+from . import database, models, rate_limit
 from .models import User, TokenData
 
-# Secret key to encode/decode JWTs
-SECRET_KEY = "a_very_secret_key"  # Replace with a real secret key in production
+# Secret key that signs the JWTs and keys the HMAC of one-time codes (see auth_tokens.hash_code). It
+# comes from the environment: with a key in the repository anybody could forge tokens, and reverse
+# stored OTPs by trying all million codes. Without SECRET_KEY, production (APP_ENV=production) refuses
+# to start and other environments fall back to a development key.
+APP_ENV = os.getenv("APP_ENV", "development")
+SECRET_KEY = os.getenv("SECRET_KEY", "")
+if not SECRET_KEY:
+    if APP_ENV == "production":
+        raise RuntimeError("SECRET_KEY must be set when APP_ENV is production")
+    print("SECRET_KEY is not set, using an insecure development key")
+    SECRET_KEY = "insecure-development-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# EventSource cannot send an Authorization header, so GET /events takes a ticket in the query string,
+# where it ends up in access logs. A ticket is a JWT with the "events" scope that expires after
+# STREAM_TICKET_EXPIRE_SECONDS and is accepted by nothing but the stream.
+STREAM_TICKET_EXPIRE_SECONDS = int(os.getenv("STREAM_TICKET_EXPIRE_SECONDS", 30))
+STREAM_TICKET_SCOPE = "events"
+
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Authenticated users are cached in-process so most requests never touch the users table.
+# Entries are dropped explicitly when admin status or the password changes, and expire after the TTL
+# so other worker processes pick up such changes too.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by the endpoints: just what authorization needs, no ORM object."""
+    id: int
+    is_admin: bool
+
+class PrincipalCache:
+    """LRU cache of principals keyed by user id, with a time-to-live per entry."""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple[float, Principal]]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return principal
+
+    def set(self, principal: Principal):
+        self._entries[principal.id] = (time.monotonic() + self.ttl_seconds, principal)
+        self._entries.move_to_end(principal.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+principal_cache = PrincipalCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE)
+
+def invalidate_user(user_id: int):
+    """Forget the cached principal of a user, call after changing admin status or password."""
+    principal_cache.invalidate(user_id)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# pbkdf2_sha256 costs tens of milliseconds of CPU per call. Inside the API it runs in a process pool
+# so a burst of logins cannot freeze the event loop. The number of calls waiting for or running in
+# the pool is capped: beyond PASSWORD_HASH_MAX_PENDING the request is rejected with 503 right away
+# instead of queueing up latency for everybody. The workers are spawned, not forked: by the time the
+# pool starts the process runs the event loop, aiosqlite and to_thread threads, and forking a
+# multithreaded process can leave the children deadlocked on a lock some thread held.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+
+def _warm_up():
+    pass
+
+class PasswordHashPool:
+    """Bounded process pool for password hashing and verification."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def start(self):
+        """Spawn the workers now: a spawned worker imports the backend first, too slow for the first logins."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._get_executor(), _warm_up) for _ in range(self.workers)))
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hash_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+async def verify_password_async(plain_password, hashed_password):
+    """verify_password for async code, runs in the password hash pool."""
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """get_password_hash for async code, runs in the password hash pool."""
+    return await password_hash_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, is_admin: bool, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -35,7 +166,25 @@ def create_access_token(data: dict, is_admin: bool, expires_delta: timedelta | N
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def create_stream_ticket(principal: Principal) -> str:
+    expire = datetime.utcnow() + timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS)
+    return jwt.encode({"user_id": principal.id, "scope": STREAM_TICKET_SCOPE, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+def user_id_from_stream_ticket(ticket: str) -> int:
+    """Validate a stream ticket. Tickets are only seconds old, so the user is not looked up again."""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        payload = {}
+    if payload.get("scope") != STREAM_TICKET_SCOPE or payload.get("user_id") is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired ticket")
+    return payload["user_id"]
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)):
+    return await principal_from_token(token, db)
+
+async def principal_from_token(token: str, db: AsyncSession) -> Principal:
+    """Validate an access token and return its principal."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -44,16 +193,35 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("user_id")
-        if user_id is None:
+        if user_id is None or payload.get("scope") is not None: # Stream tickets are not access tokens
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        # Cache miss: make sure the user still exists and read the current admin flag
+        user = (await db.execute(select(models.User.id, models.User.is_admin).where(models.User.id == user_id))).first()
+        # End the read transaction: the connection goes back to the pool instead of being held for the
+        # whole request, while the endpoint may check out another one (read session, write buffer, ...)
+        await db.rollback()
+        if user is None:
+            raise credentials_exception
+        principal = Principal(id=user.id, is_admin=bool(user.is_admin))
+        principal_cache.set(principal)
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(database.get_db)):
+    """Full ORM user, for the few endpoints that need more than the principal."""
+    user = await db.get(models.User, principal.id)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
-def admin_required(current_user: models.User = Depends(get_current_user)):
+def admin_required(current_user: Principal = Depends(get_current_principal)):
     if not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -61,15 +229,24 @@ def admin_required(current_user: models.User = Depends(get_current_user)):
         )
     return current_user
 
-def authenticate_user(db: Session, credential: str, password: str):
+async def authenticate_user(db: AsyncSession, credential: str, password: str):
     print("Attempting to authenticate user:", credential)
+    # Only the columns the login needs, as a plain row (ORM objects would be expired by the rollback below)
+    columns = (User.id, User.is_admin, User.hashed_password)
     # Try to find user by username
-    user = db.query(User).filter(User.username == credential).first()
+    user = (await db.execute(select(*columns).where(User.username == credential))).first()
     
     # If not found by username, try to find by email
     if not user:
-        user = db.query(User).filter(User.email == credential).first()
+        user = (await db.execute(select(*columns).where(User.email == credential))).first()
 
-    if not user or not verify_password(password, user.hashed_password):
+    # End the read transaction before queueing for the hash pool, so a burst of logins does not hold
+    # every pooled connection while it waits (same as principal_from_token)
+    await db.rollback()
+    if not user or not user.hashed_password:
+        return False
+    # Per account, so that alternating between username and email does not double the budget
+    await rate_limit.throttle(f"/token:account:{user.id}", rate_limit.LOGIN_PER_ACCOUNT)
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
\ No newline at end of file
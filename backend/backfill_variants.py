@@ -0,0 +1,45 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.database import SessionLocal, Base, engine
+from backend import models, variants
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+
+def backfill_variants(workers: int, rebuild: bool):
+    """Render the responsive variants of existing uploads that do not have any yet."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        images = db.query(models.Image).order_by(models.Image.id)
+        if not rebuild:
+            images = images.filter(~models.Image.id.in_(db.query(models.ImageVariant.image_id)))
+        images = [image for image in images if os.path.exists(os.path.join(UPLOADS_DIR, image.filename))]
+        print(f"Rendering variants for {len(images)} image(s) with {workers} worker(s)...")
+
+        variants_dir = os.path.join(UPLOADS_DIR, variants.VARIANTS_SUBDIR)
+        sources = [os.path.join(UPLOADS_DIR, image.filename) for image in images]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for image, written in zip(images, pool.map(variants.generate_variants, sources, [variants_dir] * len(sources))):
+                db.query(models.ImageVariant).filter(models.ImageVariant.image_id == image.id).delete()
+                db.add_all([
+                    models.ImageVariant(image_id=image.id, width=width, format=fmt, filename=f"{variants.VARIANTS_SUBDIR}/{filename}")
+                    for width, fmt, filename in written
+                ])
+                db.commit()
+                print(f"Image {image.id} ({image.filename}): {len(written)} variant(s)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Render thumbnails and responsive variants for existing uploads.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--rebuild", action="store_true", help="Re-render images that already have variants")
+    args = parser.parse_args()
+
+    backfill_variants(args.workers, args.rebuild)
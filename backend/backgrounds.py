@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from PIL import Image as PILImage
+
+# The login page asks for the background list on every auth change. The listing, the pixel size and
+# the dominant colour of every background (used as a placeholder while the photo loads) are computed
+# once and kept in memory together with the serialized JSON body and its ETag. The directory mtime
+# is checked at most every BACKGROUNDS_CHECK_SECONDS, adding or removing a file triggers a rebuild
+# in a worker thread. Requests in between do no filesystem work at all.
+BACKGROUNDS_CHECK_SECONDS = float(os.getenv("BACKGROUNDS_CHECK_SECONDS", 10))
+
+def describe_background(path: str) -> dict:
+    """Pixel size and dominant colour (as #rrggbb) of one background image."""
+    with PILImage.open(path) as image:
+        width, height = image.size
+        # Reduce to a small palette of a thumbnail and pick the most frequent colour
+        image.draft("RGB", (64, 64)) # Lets JPEG decode at reduced size
+        thumbnail = image.convert("RGB").resize((32, 32))
+        palette = thumbnail.quantize(colors=5)
+        count, index = max(palette.getcolors())
+        r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+    return {"width": width, "height": height, "dominant_color": f"#{r:02x}{g:02x}{b:02x}"}
+
+class BackgroundCatalog:
+    """In-memory, change-invalidated listing of a backgrounds directory."""
+
+    def __init__(self, directory: str, static_prefix: str, versioned_path, check_seconds: float = BACKGROUNDS_CHECK_SECONDS):
+        self.directory = directory
+        self.static_prefix = static_prefix
+        self.versioned_path = versioned_path # Maps a path under /static to its immutable "?v=" URL path
+        self.check_seconds = check_seconds
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self._mtime_ns: Optional[int] = None
+        self._next_check = 0.0
+        self._lock = asyncio.Lock()
+
+    def _build(self, mtime_ns: int):
+        entries = []
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if not os.path.isfile(path):
+                continue
+            entry = {"filename": filename, "path": self.versioned_path(f"{self.static_prefix}/{filename}")}
+            try:
+                entry.update(describe_background(path))
+            except Exception:
+                entry.update({"width": None, "height": None, "dominant_color": None}) # Not an image Pillow can read
+            entries.append(entry)
+        body = json.dumps(entries, separators=(",", ":")).encode()
+        return mtime_ns, body, f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+    async def get(self):
+        """Return (body, etag), or (None, None) when the directory does not exist."""
+        now = time.monotonic()
+        if self.body is not None and now < self._next_check:
+            return self.body, self.etag
+        async with self._lock:
+            if self.body is not None and time.monotonic() < self._next_check:
+                return self.body, self.etag # Another request refreshed it meanwhile
+            try:
+                mtime_ns = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                self.body = self.etag = self._mtime_ns = None
+                return None, None
+            if mtime_ns != self._mtime_ns:
+                self._mtime_ns, self.body, self.etag = await asyncio.to_thread(self._build, mtime_ns)
+            self._next_check = time.monotonic() + self.check_seconds
+        return self.body, self.etag
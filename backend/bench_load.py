@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Event night load test. Seeds a database with users, images, likes, reactions and votes, then replays
+# the traffic of an event through backend.main:app in process (httpx ASGITransport, no server, no
+# external services):
+# - login: every guest logs in at once when the doors open
+# - mixed: guests poll the gallery (with If-None-Match, like the browser) and the vote summary,
+#   toggle likes, reactions and votes
+# - like_storm: everyone hammers the same few photos
+# Latency percentiles and throughput per phase and endpoint are printed and saved as JSON. Pass an
+# earlier result to --baseline to see what changed between two commits. Run from the project root.
+#
+# The database is a scratch file unless --database is given: the app binds DATABASE_URL at import, so
+# it is set before backend is imported.
+
+REACTION_EMOJIS = ("👍", "❤️", "😂")
+PASSWORD = "load-password"
+LOGIN_ATTEMPTS = 20
+
+def _fridays(month_start: date) -> List[str]:
+    """The Fridays of a month, formatted like the voting page (Date.toDateString)."""
+    day = month_start + timedelta(days=(4 - month_start.weekday()) % 7)
+    fridays = []
+    while day.month == month_start.month:
+        fridays.append(day.strftime("%a %b %d %Y"))
+        day += timedelta(days=7)
+    return fridays
+
+def seed(args, rng: random.Random):
+    """Fill the database through models, then rebuild the counters from the raw rows."""
+    from sqlalchemy import delete, insert
+
+    from backend import auth_utils, database, migrations, models, stats
+
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.upgrade(database.engine)
+    month_start = date.today().replace(day=1)
+    month, fridays = month_start.strftime("%B"), _fridays(month_start)
+    hashed_password = auth_utils.get_password_hash(PASSWORD) # Hashed once, pbkdf2 is slow on purpose
+
+    with database.engine.begin() as conn:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            if table.name != "schema_migrations":
+                conn.execute(delete(table))
+        conn.execute(insert(models.User), [
+            {"id": i, "username": f"guest{i}", "email": f"guest{i}@example.com", "hashed_password": hashed_password, "is_admin": i == 1}
+            for i in range(1, args.users + 1)
+        ])
+        conn.execute(insert(models.Image), [
+            {"id": i, "filename": f"load_{i}.jpg", "caption": f"Photo {i}", "user_id": 1} for i in range(1, args.images + 1)
+        ])
+        likes = {(rng.randint(1, args.users), rng.randint(1, args.images)) for _ in range(args.likes)}
+        if likes:
+            conn.execute(insert(models.Like), [{"user_id": u, "image_id": i} for u, i in likes])
+        reactions = {(rng.randint(1, args.users), rng.randint(1, args.images), rng.choice(REACTION_EMOJIS)) for _ in range(args.reactions)}
+        if reactions:
+            conn.execute(insert(models.Reaction), [{"user_id": u, "image_id": i, "emoji": e} for u, i, e in reactions])
+        votes = {(rng.randint(1, args.users), rng.choice(fridays)) for _ in range(args.votes)}
+        if votes:
+            conn.execute(insert(models.Vote), [{"user_id": u, "event_date": d, "month": month} for u, d in votes])
+        stats.reconcile(conn)
+    return month, fridays
+
+class Recorder:
+    """Latency samples per phase and endpoint."""
+
+    def __init__(self):
+        self.samples: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.elapsed: Dict[str, float] = {}
+        self.phase = None
+
+    async def request(self, client, label: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples[self.phase][label].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[self.phase][label] += 1
+        return response
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    """Nearest rank percentile of sorted samples."""
+    return ordered[max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))]
+
+def _summary(samples: List[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(samples)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+async def _run_phase(recorder: Recorder, name: str, guests, action):
+    """Run `action(guest)` for every guest concurrently and time the whole phase."""
+    recorder.phase = name
+    start = time.perf_counter()
+    await asyncio.gather(*(action(guest) for guest in guests))
+    recorder.elapsed[name] = time.perf_counter() - start
+
+async def replay(args, month: str, fridays: List[str], rng: random.Random) -> Recorder:
+    import httpx
+    from fastapi import status
+
+    from backend import rate_limit
+    from backend.main import app
+
+    # The limiter stays on: like here, the guests of a real event share the venue's NAT address
+    rate_limit.RATE_LIMIT_ENABLED = not args.no_rate_limit
+    recorder = Recorder()
+    guests = [{"id": i, "username": f"guest{i}", "rng": random.Random(rng.random()), "etag": None}
+              for i in range(1, min(args.guests, args.users) + 1)]
+    hot_images = list(range(1, min(args.images, 3) + 1))
+
+    async def login(guest):
+        for attempt in range(1, LOGIN_ATTEMPTS + 1):
+            response = await recorder.request(client, "POST /token", "POST", "/token", data={"username": guest["username"], "password": PASSWORD})
+            if response.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+                break
+            # The hashing pool is full (counted as an error), the guest tries again a moment later
+            await asyncio.sleep(0.05 * attempt)
+        response.raise_for_status()
+        guest["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def poll_gallery(guest):
+        headers = dict(guest["headers"])
+        if guest["etag"]:
+            headers["If-None-Match"] = guest["etag"]
+        response = await recorder.request(client, "GET /images/", "GET", "/images/", headers=headers)
+        guest["etag"] = response.headers.get("etag", guest["etag"])
+        if response.status_code == 200 and response.json()["next_cursor"] and guest["rng"].random() < 0.2:
+            # Some guests scroll down
+            await recorder.request(client, "GET /images/?after", "GET", f"/images/?after={response.json()['next_cursor']}", headers=guest["headers"])
+
+    def like(guest, images):
+        return recorder.request(client, "POST /images/{id}/like", "POST", f"/images/{guest['rng'].choice(images)}/like", headers=guest["headers"])
+
+    def react(guest):
+        return recorder.request(client, "POST /images/{id}/react", "POST", f"/images/{guest['rng'].randint(1, args.images)}/react",
+                                json={"emoji": guest["rng"].choice(REACTION_EMOJIS)}, headers=guest["headers"])
+
+    def vote(guest):
+        return recorder.request(client, "POST /votes", "POST", "/votes", json={"event_date": guest["rng"].choice(fridays), "month": month},
+                                headers=guest["headers"])
+
+    def summary(guest):
+        return recorder.request(client, "GET /votes/{month}/summary", "GET", f"/votes/{month}/summary", headers=guest["headers"])
+
+    all_images = list(range(1, args.images + 1))
+    mix = [
+        (50, poll_gallery),
+        (20, lambda guest: like(guest, all_images)),
+        (10, react),
+        (10, vote),
+        (10, summary),
+    ]
+    weights, actions = zip(*mix)
+
+    async def mixed(guest):
+        for _ in range(args.actions):
+            await guest["rng"].choices(actions, weights)[0](guest)
+
+    async def like_storm(guest):
+        for _ in range(args.storm):
+            await like(guest, hot_images)
+
+    # The lifespan starts the background workers (password hash pool, write buffer, ...)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            await _run_phase(recorder, "login", guests, login)
+            await _run_phase(recorder, "mixed", guests, mixed)
+            await _run_phase(recorder, "like_storm", guests, like_storm)
+    return recorder
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _app_settings() -> dict:
+    """The settings that change the numbers, so results of different configurations are not mixed up."""
+    from backend import auth_utils, database, write_buffer
+    return {
+        "DB_PROFILE": database.DB_PROFILE,
+        "PASSWORD_HASH_WORKERS": auth_utils.PASSWORD_HASH_WORKERS,
+        "PASSWORD_HASH_MAX_PENDING": auth_utils.PASSWORD_HASH_MAX_PENDING,
+        "WRITE_BUFFER_ENABLED": write_buffer.WRITE_BUFFER_ENABLED,
+        "WRITE_BUFFER_DURABILITY": write_buffer.WRITE_BUFFER_DURABILITY,
+        "cpu_count": os.cpu_count(),
+    }
+
+def report(args, recorder: Recorder) -> dict:
+    phases = {}
+    for phase, endpoints in recorder.samples.items():
+        elapsed = recorder.elapsed[phase]
+        all_samples = [sample for samples in endpoints.values() for sample in samples]
+        phases[phase] = {
+            "elapsed_s": round(elapsed, 3),
+            "total": _summary(all_samples, sum(recorder.errors[phase].values()), elapsed),
+            "endpoints": {label: _summary(samples, recorder.errors[phase][label], elapsed) for label, samples in sorted(endpoints.items())},
+        }
+    return {
+        "commit": _git_commit(),
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "baseline", "database")},
+        "app_settings": _app_settings(),
+        "phases": phases,
+    }
+
+def _change(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+def print_report(result: dict, baseline: dict = None):
+    print(f"{'phase / endpoint':<38}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}" + ("   p95 vs baseline" if baseline else ""))
+    for phase, data in result["phases"].items():
+        rows = [(phase, data["total"], ("phases", phase, "total"))]
+        rows += [(f"  {label}", stats, ("phases", phase, "endpoints", label)) for label, stats in data["endpoints"].items()]
+        for name, stats, path in rows:
+            line = f"{name:<38}{stats['requests']:>6}{stats['errors']:>5}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+            if baseline:
+                old = baseline
+                for key in path:
+                    old = old.get(key, {})
+                line += f"   {_change(stats['p95_ms'], old['p95_ms']) if old else 'new':>8}"
+            print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay event night traffic against the API and report latency percentiles.")
+    parser.add_argument("--database", help="SQLite file to seed. Its contents are replaced! Default: a scratch file")
+    parser.add_argument("--users", type=int, default=200, help="Seeded users")
+    parser.add_argument("--images", type=int, default=60, help="Seeded images")
+    parser.add_argument("--likes", type=int, default=2000, help="Seeded likes (duplicates are dropped)")
+    parser.add_argument("--reactions", type=int, default=1000, help="Seeded reactions (duplicates are dropped)")
+    parser.add_argument("--votes", type=int, default=300, help="Seeded votes (duplicates are dropped)")
+    parser.add_argument("--guests", type=int, default=50, help="Concurrent guests replaying the workload (at most --users)")
+    parser.add_argument("--actions", type=int, default=20, help="Requests per guest in the mixed phase")
+    parser.add_argument("--storm", type=int, default=10, help="Likes per guest in the like storm")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Turn the login / OTP rate limiter off")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed, the same seed replays the same requests")
+    parser.add_argument("--output", default="load_results.json", help="Where to save the results")
+    parser.add_argument("--baseline", help="Earlier results to compare p95 latencies against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.abspath(args.database or os.path.join(tmp_dir, "load.db"))
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ.pop("DATABASE_REPLICA_URL", None)
+        rng = random.Random(args.seed)
+
+        from backend import database
+        month, fridays = seed(args, rng)
+        recorder = asyncio.run(replay(args, month, fridays, rng))
+        database.engine.dispose()
+
+    result = report(args, recorder)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"Saved to {args.output}")
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from backend import auth_utils, database, migrations, models, rate_limit
+from backend.main import app
+
+rate_limit.RATE_LIMIT_ENABLED = False # Measures the hashing pool, not the login throttle
+
+async def _login_burst(client: httpx.AsyncClient, logins: int, concurrency: int):
+    """Fire `logins` POST /token requests, `concurrency` at a time. Returns (ok, rejected, elapsed)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = []
+
+    async def login(i: int):
+        async with semaphore:
+            response = await client.post("/token", data={"username": f"bench{i % 10}", "password": "bench-password"})
+            statuses.append(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    return statuses.count(200), statuses.count(503), elapsed
+
+async def _run(worker_counts, logins: int, concurrency: int, max_pending: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        engine = database.build_engine(url)
+        models.Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+        db = sessionmaker(bind=engine)()
+        hashed_password = auth_utils.get_password_hash("bench-password")
+        db.add_all([models.User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password=hashed_password) for i in range(10)])
+        db.commit()
+        db.close()
+        engine.dispose()
+
+        async_engine = database.build_async_engine(url)
+        BenchSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        async def override_get_db():
+            async with BenchSession() as session:
+                yield session
+
+        app.dependency_overrides[database.get_db] = override_get_db
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for workers in worker_counts:
+                    auth_utils.password_hash_pool = auth_utils.PasswordHashPool(workers, max_pending)
+                    # Warm the worker processes up before measuring
+                    await _login_burst(client, workers * 2, workers * 2)
+                    ok, rejected, elapsed = await _login_burst(client, logins, concurrency)
+                    auth_utils.password_hash_pool.shutdown()
+                    print(f"{workers:>3} worker(s): {ok / elapsed:7.1f} logins/s, {rejected} rejected with 503, {elapsed:.2f}s")
+        finally:
+            app.dependency_overrides.pop(database.get_db, None)
+            await async_engine.dispose()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure POST /token throughput against the password hash pool size.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1], help="Pool sizes to compare")
+    parser.add_argument("--logins", type=int, default=200, help="Logins per pool size")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent login requests")
+    parser.add_argument("--max-pending", type=int, default=1000, help="Queue depth before 503 (default: never reject)")
+    args = parser.parse_args()
+
+    asyncio.run(_run(sorted(set(args.workers)), args.logins, args.concurrency, args.max_pending))
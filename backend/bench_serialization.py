@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pydantic import TypeAdapter
+
+from backend import fast_json, models
+from backend.main import ImageInfo, RegistrationInfo, UserPublic, VoteAdminInfo, VoteInfo
+
+# Compares the two ways a list endpoint can turn database rows into a JSON body:
+# - orm_mode: ORM objects validated against the response model, dumped to JSON-compatible Python and
+#   encoded with json.dumps (what FastAPI does for a response_model)
+# - fast path: plain column tuples zipped into dicts and encoded with orjson (see fast_json.py)
+
+def _registrations(n: int):
+    orm = [models.Registration(id=i, name=f"Guest {i}", guests=i % 4, user_id=i % 50 + 1) for i in range(n)]
+    tuples = [(r.name, r.guests, r.id, r.user_id) for r in orm]
+    return List[RegistrationInfo], orm, ("name", "guests", "id", "user_id"), tuples
+
+def _votes(n: int):
+    orm = [models.Vote(id=i, user_id=i % 50 + 1, event_date=f"Fri Oct {i % 28 + 1:02d} 2025", month="October") for i in range(n)]
+    tuples = [(v.event_date, v.month, v.id, v.user_id) for v in orm]
+    return List[VoteInfo], orm, ("event_date", "month", "id", "user_id"), tuples
+
+def _users(n: int):
+    orm = [models.User(id=i, username=f"user{i}", email=f"user{i}@example.com", is_admin=i % 10 == 0) for i in range(n)]
+    tuples = [(u.id, u.username, u.email, u.is_admin) for u in orm]
+    return List[UserPublic], orm, ("id", "username", "email", "is_admin"), tuples
+
+def _admin_votes(n: int):
+    owners = [models.User(id=i, username=f"user{i}", email=f"user{i}@example.com", is_admin=False) for i in range(50)]
+    orm = [models.Vote(id=i, event_date="Fri Oct 03 2025", month="October", owner=owners[i % 50]) for i in range(n)]
+    tuples = [(v.id, v.event_date, v.month, {"id": v.owner.id, "username": v.owner.username, "email": v.owner.email, "is_admin": False})
+              for v in orm]
+    return List[VoteAdminInfo], orm, ("id", "event_date", "month", "owner"), tuples
+
+def _images(n: int):
+    reactions = {"👍": 3, "❤️": 1}
+    srcset = {"webp": "http://localhost:8000/static/variants/a-320.webp 320w, http://localhost:8000/static/variants/a-640.webp 640w"}
+    rows = [dict(id=i, filename=f"{i:064x}.jpg", caption=f"Photo {i}", user_id=1, like_count=i % 30,
+                 reaction_counts=reactions, has_liked=i % 2 == 0, srcset=srcset) for i in range(n)]
+    # The gallery already builds per-row dicts, orm_mode here means validating them into ImageInfo
+    return List[ImageInfo], rows, tuple(rows[0]), [tuple(row.values()) for row in rows]
+
+DATASETS = {
+    "registrations": _registrations,
+    "votes": _votes,
+    "users": _users,
+    "admin_votes": _admin_votes,
+    "images": _images,
+}
+
+def _best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def bench(rows: int, repeat: int):
+    print(f"{'endpoint rows':<16}{'orm_mode ms':>14}{'fast path ms':>14}{'speedup':>10}   (per {rows} rows, best of {repeat})")
+    for name, make in DATASETS.items():
+        response_model, orm, keys, tuples = make(rows)
+        adapter = TypeAdapter(response_model)
+
+        def orm_mode():
+            return json.dumps(adapter.dump_python(adapter.validate_python(orm, from_attributes=True), mode="json")).encode()
+
+        def fast_path():
+            return fast_json.dumps([dict(zip(keys, row)) for row in tuples])
+
+        # Both paths must produce the same document
+        assert json.loads(orm_mode()) == json.loads(fast_path()), name
+        slow, fast = _best_of(orm_mode, repeat), _best_of(fast_path, repeat)
+        print(f"{name:<16}{slow * 1000:>14.2f}{fast * 1000:>14.2f}{slow / fast:>9.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark orm_mode serialization against the orjson fast path.")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per response")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement, the best one is reported")
+    args = parser.parse_args()
+    bench(args.rows, args.repeat)
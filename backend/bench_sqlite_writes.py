@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.database import ENGINE_PROFILES, build_engine
+
+def _writer(Session, user_id: int, image_ids, operations: int, errors: list):
+    """Toggle likes one transaction at a time, like a member clicking through the gallery."""
+    for i in range(operations):
+        image_id = image_ids[i % len(image_ids)]
+        db = Session()
+        try:
+            removed = db.execute(delete(models.Like).where(models.Like.user_id == user_id, models.Like.image_id == image_id))
+            if not removed.rowcount:
+                db.add(models.Like(user_id=user_id, image_id=image_id))
+            db.commit()
+        except OperationalError as e:
+            db.rollback()
+            errors.append(str(e.orig))
+        finally:
+            db.close()
+
+def _reader(Session, stop: threading.Event, reads: list):
+    """Poll the like counts while the writers run, like the gallery does."""
+    while not stop.is_set():
+        db = Session()
+        try:
+            db.execute(select(models.Like.image_id, func.count(models.Like.id)).group_by(models.Like.image_id)).all()
+            reads.append(1)
+        except OperationalError:
+            pass
+        finally:
+            db.close()
+
+def run_profile(profile: str, writers: int, operations: int, readers: int):
+    """Measure committed toggles per second with concurrent writers and readers on a fresh database."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = build_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", profile)
+        models.Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        db = Session()
+        users = [models.User(username=f"bench{i}", email=f"bench{i}@example.com") for i in range(writers)]
+        db.add_all(users)
+        db.commit()
+        images = [models.Image(filename=f"bench_{i}.jpg", caption="bench", user_id=users[0].id) for i in range(20)]
+        db.add_all(images)
+        db.commit()
+        user_ids = [user.id for user in users]
+        image_ids = [image.id for image in images]
+        db.close()
+
+        errors, reads = [], []
+        stop = threading.Event()
+        threads = [threading.Thread(target=_writer, args=(Session, user_id, image_ids, operations, errors)) for user_id in user_ids]
+        reader_threads = [threading.Thread(target=_reader, args=(Session, stop, reads)) for _ in range(readers)]
+
+        start = time.perf_counter()
+        for thread in reader_threads + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in reader_threads:
+            thread.join()
+        engine.dispose()
+
+    committed = writers * operations - len(errors)
+    print(f"{profile:>10}: {committed / elapsed:8.1f} writes/s, {len(reads) / elapsed:8.1f} reads/s, "
+          f"{len(errors)} failed write(s) in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare SQLite write throughput of the engine profiles.")
+    parser.add_argument("--writers", type=int, default=8, help="Concurrent writer threads")
+    parser.add_argument("--operations", type=int, default=200, help="Like toggles per writer")
+    parser.add_argument("--readers", type=int, default=2, help="Concurrent reader threads")
+    parser.add_argument("--profiles", nargs="+", default=list(ENGINE_PROFILES), choices=list(ENGINE_PROFILES))
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        run_profile(profile, args.writers, args.operations, args.readers)
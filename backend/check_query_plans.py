@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# The hot endpoints run against a scratch database. Importing backend.main creates and migrates the
+# database named by DATABASE_URL, so it is set before any backend import.
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir.name, 'plans.db')}"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+from fastapi.testclient import TestClient # Requires httpx
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from backend import database, instrumentation, models
+from backend.auth_utils import get_password_hash
+from backend.main import app
+
+# Tables that are allowed to be scanned: the gallery's first page walks images in primary key order
+# and stops after `limit` rows.
+ALLOWED_SCANS = {"images"}
+
+# Statements a single hot path request may run. More is usually a query per row (N+1).
+QUERY_BUDGET = 8
+
+def _hot_path_workload(client: TestClient):
+    """Call the hot endpoints the way the frontend does."""
+    token = client.post("/token", data={"username": "planner", "password": "planner-password"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/images/", headers=headers)
+    client.get("/images/?after=1&limit=2", headers=headers)
+    client.post("/images/1/like", headers=headers)
+    client.post("/images/1/like", headers=headers)
+    client.post("/images/1/react", json={"emoji": "👍"}, headers=headers)
+    client.post("/images/1/react", json={"emoji": "👍"}, headers=headers)
+    client.post("/votes", json={"event_date": "2025-10-03", "month": "October"}, headers=headers)
+    client.post("/votes", json={"event_date": "2025-10-03", "month": "October"}, headers=headers)
+    client.get("/votes/October", headers=headers)
+    client.get("/votes/October/summary", headers=headers)
+    client.get("/users/?q=plan", headers=headers)
+    client.get("/users/?is_admin=true&after=1", headers=headers)
+    client.get("/admin/votes?month=October", headers=headers)
+    client.get("/admin/votes?q=plan&after=1", headers=headers)
+
+def check_query_plans() -> bool:
+    """Run the hot endpoints against a scratch database and EXPLAIN QUERY PLAN every statement they issue."""
+    try:
+        engine = database.engine
+        async_engine = database.async_engine
+        db = sessionmaker(bind=engine)()
+        user = models.User(username="planner", email="planner@example.com", hashed_password=get_password_hash("planner-password"), is_admin=True)
+        db.add(user)
+        db.commit()
+        db.add_all([models.Image(filename=f"plan_{i}.jpg", caption="plan", user_id=user.id) for i in range(3)])
+        db.commit()
+        db.close()
+
+        statements = []
+        instrumentation.QUERY_BUDGET = QUERY_BUDGET
+
+        @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, executemany):
+            # Only statements of requests, not those of the background workers sharing the database
+            if instrumentation.current() is None:
+                return
+            if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                statements.append((statement, parameters))
+
+        try:
+            with TestClient(app) as client:
+                _hot_path_workload(client)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+        ok = True
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                # Only tables count, scanning a (LIMIT bounded) subquery such as anon_1 is fine
+                scans = [row[3] for row in plan if row[3].startswith("SCAN ")
+                         and row[3].split()[1] in models.Base.metadata.tables and row[3].split()[1] not in ALLOWED_SCANS]
+                if scans:
+                    ok = False
+                    print(f"FULL TABLE SCAN: {'; '.join(scans)}\n    {' '.join(statement.split())}")
+    finally:
+        database.engine.dispose()
+        _tmp_dir.cleanup()
+
+    print(f"Checked {len(statements)} statement(s): {'OK' if ok else 'full table scans found'}")
+    if instrumentation.registry.flagged:
+        ok = False
+        print(f"{len(instrumentation.registry.flagged)} request(s) ran more than {QUERY_BUDGET} statements, see above")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
@@ -0,0 +1,231 @@
+import asyncio
+import os
+import sys
+import tempfile
+import traceback
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Checks of the write buffer (see write_buffer.py) against a scratch database: coalescing, failed
+# flushes, and shutdown. The database URL is bound when backend is imported, so it is set first.
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir.name, 'write_buffer.db')}"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+from fastapi import HTTPException
+from sqlalchemy import delete, event, insert, select
+
+from backend import database, events, migrations, models, stats, toggles
+from backend.write_buffer import WriteBuffer
+
+USERS = 3
+IMAGES = 2
+
+def _reset():
+    """Empty tables with USERS users and IMAGES images."""
+    with database.engine.begin() as conn:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            if table.name != "schema_migrations":
+                conn.execute(delete(table))
+        conn.execute(insert(models.User), [{"id": i, "username": f"user{i}", "email": f"user{i}@example.com"} for i in range(1, USERS + 1)])
+        conn.execute(insert(models.Image), [{"id": i, "filename": f"{i}.jpg", "caption": "", "user_id": 1} for i in range(1, IMAGES + 1)])
+
+def _likes():
+    """(user_id, image_id) of every like and the like counter of every image."""
+    with database.engine.connect() as conn:
+        likes = set(conn.execute(select(models.Like.user_id, models.Like.image_id)).all())
+        counts = dict(conn.execute(select(models.ImageStats.image_id, models.ImageStats.like_count)).all())
+    return likes, {image_id: count for image_id, count in counts.items() if count}
+
+class _Commits:
+    """Counts the transactions committed on the async engine."""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(database.async_engine.sync_engine, "commit", self._commit)
+
+    def _commit(self, conn):
+        self.count += 1
+
+    def close(self):
+        event.remove(database.async_engine.sync_engine, "commit", self._commit)
+
+class _FailOnce:
+    """Replace module.name with a function that raises on its first call."""
+
+    def __init__(self, module, name: str, error: Exception):
+        self.module, self.name, self.error = module, name, error
+        self.original = getattr(module, name)
+        self.calls = 0
+
+    async def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise self.error
+        return await self.original(*args, **kwargs)
+
+    def __enter__(self):
+        setattr(self.module, self.name, self)
+        return self
+
+    def __exit__(self, *exc):
+        setattr(self.module, self.name, self.original)
+
+async def check_toggles_cancel_out():
+    buffer = WriteBuffer(enabled=True, flush_ms=10_000, durability="buffered")
+    buffer.start()
+    commits = _Commits()
+    try:
+        assert await buffer.toggle_like(1, 1) is True
+        assert await buffer.toggle_like(1, 1) is False
+        assert await buffer.toggle_reaction(2, 1, "👍") is True
+        assert await buffer.toggle_reaction(2, 1, "👍") is False
+        assert not buffer.pending, buffer.pending
+        assert await buffer.toggle_like(1, 99) is None # Unknown image
+        await buffer.stop()
+    finally:
+        commits.close()
+    assert commits.count == 0, f"{commits.count} commit(s) for changes that cancelled out"
+    assert _likes() == (set(), {})
+
+async def check_group_commit():
+    buffer = WriteBuffer(enabled=True, flush_ms=20, durability="group")
+    buffer.start()
+    commits = _Commits()
+    try:
+        results = await asyncio.gather(*(buffer.toggle_like(user_id, image_id)
+                                         for user_id in range(1, USERS + 1) for image_id in range(1, IMAGES + 1)))
+        await buffer.stop()
+    finally:
+        commits.close()
+    assert all(results), results
+    assert commits.count == 1, f"{commits.count} commits, expected the toggles to share one"
+    assert _likes() == ({(u, i) for u in range(1, USERS + 1) for i in range(1, IMAGES + 1)}, {i: USERS for i in range(1, IMAGES + 1)})
+
+async def check_overlay():
+    buffer = WriteBuffer(enabled=True, flush_ms=10_000, durability="buffered")
+    buffer.start()
+    await buffer.toggle_like(1, 1)
+    await buffer.toggle_reaction(2, 2, "👍")
+    like_delta, liked, reaction_delta = buffer.overlay(1, [1, 2])
+    assert like_delta == {1: 1} and liked == {1: True} and reaction_delta == {2: {"👍": 1}}, (like_delta, liked, reaction_delta)
+    await buffer.stop()
+    assert buffer.overlay(1, [1, 2]) == ({}, {}, {})
+    assert _likes() == ({(1, 1)}, {1: 1})
+
+async def check_requeue_buffered():
+    buffer = WriteBuffer(enabled=True, flush_ms=10_000, durability="buffered")
+    buffer.start()
+    await buffer.toggle_like(1, 1)
+    with _FailOnce(toggles, "set_like", RuntimeError("database is locked")):
+        await buffer.flush()
+        assert buffer.pending, "the acknowledged change was dropped by the failed flush"
+        assert _likes() == (set(), {})
+        await buffer.flush()
+    await buffer.stop()
+    assert _likes() == ({(1, 1)}, {1: 1})
+
+async def check_failure_group():
+    buffer = WriteBuffer(enabled=True, flush_ms=10, durability="group")
+    buffer.start()
+    with _FailOnce(toggles, "set_like", RuntimeError("database is locked")):
+        try:
+            await asyncio.wait_for(buffer.toggle_like(1, 1), timeout=5)
+            raise AssertionError("the toggle succeeded although its flush failed")
+        except HTTPException as e:
+            assert e.status_code == 503, e.status_code
+        assert not buffer.pending, "a change the request was told failed is retried"
+        # The flusher is still running
+        assert await asyncio.wait_for(buffer.toggle_like(1, 1), timeout=5) is True
+    await buffer.stop()
+    assert _likes() == ({(1, 1)}, {1: 1})
+
+async def check_publish_failure():
+    buffer = WriteBuffer(enabled=True, flush_ms=10, durability="group")
+    buffer.start()
+    with _FailOnce(stats, "like_count", RuntimeError("database is locked")):
+        assert await asyncio.wait_for(buffer.toggle_like(1, 1), timeout=5) is True
+        await asyncio.sleep(0.05) # Let the failing publish run
+        assert await asyncio.wait_for(buffer.toggle_like(2, 1), timeout=5) is True, "the flusher died"
+    await buffer.stop()
+    assert _likes() == ({(1, 1), (2, 1)}, {1: 2})
+
+async def check_stop_during_flush():
+    buffer = WriteBuffer(enabled=True, flush_ms=10, durability="buffered")
+    buffer.start()
+    original = toggles.set_like
+
+    async def slow_set_like(*args):
+        await asyncio.sleep(0.2)
+        return await original(*args)
+
+    toggles.set_like = slow_set_like
+    try:
+        await buffer.toggle_like(1, 1)
+        while not buffer.inflight:
+            await asyncio.sleep(0.005)
+        await buffer.stop() # The flush is in progress
+    finally:
+        toggles.set_like = original
+    assert _likes() == ({(1, 1)}, {1: 1})
+
+async def check_flush_cancelled():
+    buffer = WriteBuffer(enabled=True, flush_ms=10_000, durability="buffered")
+    buffer.start()
+    original = toggles.set_like
+
+    async def slow_set_like(*args):
+        await asyncio.sleep(0.2)
+        return await original(*args)
+
+    toggles.set_like = slow_set_like
+    try:
+        await buffer.toggle_like(1, 1)
+        flush = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+    finally:
+        toggles.set_like = original
+    assert buffer.pending, "the changes of the cancelled flush were lost"
+    await buffer.stop()
+    assert _likes() == ({(1, 1)}, {1: 1})
+
+CHECKS = [
+    check_toggles_cancel_out,
+    check_group_commit,
+    check_overlay,
+    check_requeue_buffered,
+    check_failure_group,
+    check_publish_failure,
+    check_stop_during_flush,
+    check_flush_cancelled,
+]
+
+async def _run_checks() -> bool:
+    ok = True
+    for check in CHECKS:
+        _reset()
+        try:
+            await check()
+            print(f"{check.__name__}: OK")
+        except Exception:
+            ok = False
+            print(f"{check.__name__}: FAILED")
+            traceback.print_exc()
+    events.bus.close()
+    await database.async_engine.dispose()
+    return ok
+
+def check_write_buffer() -> bool:
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.upgrade(database.engine)
+    try:
+        return asyncio.run(_run_checks())
+    finally:
+        database.engine.dispose()
+        _tmp_dir.cleanup()
+
+if __name__ == "__main__":
+    sys.exit(0 if check_write_buffer() else 1)
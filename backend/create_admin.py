@@ -1,8 +1,6 @@
 import sys
 import os
-import time
 import argparse
-from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
 # Add the parent directory to sys.path to allow importing backend modules
@@ -12,9 +10,6 @@ from backend.database import SessionLocal, engine
 from backend.models import User, Base
 from backend.auth_utils import get_password_hash
 
-MAX_RETRIES = 5        # Maximum number of retries if database is locked
-RETRY_DELAY = 1        # Delay between retries in seconds
-
 def create_admin(db: Session, username: str, password: str):
     """Create or upgrade a user to admin."""
     user = db.query(User).filter(User.username == username).first()
@@ -43,15 +38,9 @@ if __name__ == "__main__":
     parser.add_argument("password", type=str, help="Admin password")
     args = parser.parse_args()
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            db = SessionLocal()
-            create_admin(db, args.username, args.password)
-            db.close()
-            break
-        except OperationalError as e:
-            if "database is locked" in str(e) and attempt < MAX_RETRIES - 1:
-                print(f"Database is locked. Retrying in {RETRY_DELAY} second(s)...")
-                time.sleep(RETRY_DELAY)
-            else:
-                raise
+    # The engine waits up to busy_timeout for a locked database (see database.ENGINE_PROFILES)
+    db = SessionLocal()
+    try:
+        create_admin(db, args.username, args.password)
+    finally:
+        db.close()
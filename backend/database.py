@@ -1,17 +1,103 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# SQLite database URL
 import os
 
 # Get the absolute path to the project root
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'event_registrations.db')}"
-print(f"Database URL: {DATABASE_URL}")
 
-# Create a SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def _normalize_url(url: str) -> str:
+    """Accept the postgres:// scheme used by most hosting providers."""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+# Database URLs come from the environment (or backend/.env). Defaults to the SQLite file in the project root.
+# DATABASE_URL is the primary that receives every write. DATABASE_REPLICA_URL is optional: when set,
+# read-only endpoints (see get_read_db) query it instead, so reads can be scaled out separately.
+DATABASE_URL = _normalize_url(os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(BASE_DIR, 'event_registrations.db')}"))
+DATABASE_REPLICA_URL = _normalize_url(os.getenv("DATABASE_REPLICA_URL", "")) or None
+
+# Async drivers used by the API, keyed by the backend name of the synchronous URL
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a database URL for its asyncio counterpart."""
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}").render_as_string(hide_password=False)
+
+# Engine profiles, selected with the DB_PROFILE environment variable.
+# "default" keeps SQLite's rollback journal and only waits on locks instead of failing with
+# "database is locked". "production" switches to WAL so readers never block the writer, relaxes
+# fsyncs to once per checkpoint (synchronous=NORMAL is still crash safe in WAL mode), gives every
+# connection a 64 MB page cache and 256 MB of memory mapped I/O, and sizes the connection pool.
+ENGINE_PROFILES = {
+    "default": {
+        "sqlite_pragmas": {
+            "busy_timeout": 5000,
+        },
+        "pool": {},
+    },
+    "production": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000)),
+            "cache_size": -64000, # Negative values are KiB
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+        "pool": {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+            "pool_timeout": 30,
+            "pool_pre_ping": True,
+        },
+    },
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+
+def _set_sqlite_pragmas(sync_engine, pragmas: dict):
+    """Run the profile's PRAGMA statements on every new SQLite connection."""
+    @event.listens_for(sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def build_engine(url: str, profile: str = DB_PROFILE):
+    """Create a synchronous engine configured with the given profile."""
+    settings = ENGINE_PROFILES[profile]
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(url, **settings["pool"])
+    sync_engine = create_engine(url, connect_args={"check_same_thread": False}, **settings["pool"])
+    _set_sqlite_pragmas(sync_engine, settings["sqlite_pragmas"])
+    return sync_engine
+
+def build_async_engine(url: str, profile: str = DB_PROFILE):
+    """Create an async engine for a synchronous URL, configured with the given profile."""
+    settings = ENGINE_PROFILES[profile]
+    async_engine = create_async_engine(to_async_url(url), **settings["pool"])
+    if make_url(url).get_backend_name() == "sqlite":
+        _set_sqlite_pragmas(async_engine.sync_engine, settings["sqlite_pragmas"])
+    return async_engine
+
+# Create a SQLAlchemy engine (used by the command line scripts and migrations)
+engine = build_engine(DATABASE_URL)
+
+# Create the async engine used by the API endpoints, so queries do not block the event loop
+async_engine = build_async_engine(DATABASE_URL)
+
+# Read-only endpoints use the replica when one is configured
+read_async_engine = build_async_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else async_engine
 
 # Create a declarative base
 Base = declarative_base()
@@ -22,11 +108,24 @@ Base = declarative_base()
 # Create a sessionmaker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
+# Objects stay readable after commit, so endpoints can return them without lazy loads
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+AsyncReadSessionLocal = async_sessionmaker(read_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def dialect_insert(db: AsyncSession, model):
+    """Dialect specific INSERT that supports ON CONFLICT (upserts, idempotent inserts)."""
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# Dependency to get the database session (primary, for endpoints that write)
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependency to get a read-only database session (replica if configured, otherwise the primary)
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
@@ -10,6 +10,9 @@ from backend.database import DATABASE_URL
 from backend.auth_utils import get_password_hash
 
 def direct_insert_user(username: str, password: str, is_admin: bool = False):
+    if not DATABASE_URL.startswith("sqlite:///"):
+        print("direct_insert_user only supports SQLite databases, use create_admin.py instead.")
+        return
     db_path = DATABASE_URL.replace("sqlite:///", "")
     conn = None
     try:
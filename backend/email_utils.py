@@ -1,10 +1,19 @@
+import asyncio
 import smtplib
 import os
 import random
 import string
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
 
 def generate_otp(length=6):
     """Generate a random OTP of specified length."""
@@ -12,24 +21,22 @@ def generate_otp(length=6):
     otp = ''.join(random.choice(characters) for i in range(length))
     return otp
 
-def send_otp_email(recipient_email: str, otp: str):
-    """Sends an OTP to the recipient's email address."""
-    SMTP_SERVER = os.getenv("SMTP_SERVER")
-    SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-    SMTP_USERNAME = os.getenv("SMTP_USERNAME")
-    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-    SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-
-    if not all([SMTP_SERVER, SMTP_USERNAME, SMTP_PASSWORD, SENDER_EMAIL]):
-        print("Email sending skipped: SMTP configuration missing in environment variables.")
-        print(f"Recipient: {recipient_email}, OTP: {otp}")
-        return False
-
-    msg = MIMEMultipart()
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = recipient_email
-    msg['Subject'] = "Your One-Time Password (OTP) for Registration"
+def _smtp_settings():
+    """SMTP configuration from the environment, or None when it is incomplete."""
+    settings = {
+        "server": os.getenv("SMTP_SERVER"),
+        "port": int(os.getenv("SMTP_PORT", 587)),
+        "username": os.getenv("SMTP_USERNAME"),
+        "password": os.getenv("SMTP_PASSWORD"),
+        "sender": os.getenv("SENDER_EMAIL"),
+        "starttls": os.getenv("SMTP_STARTTLS", "true").lower() != "false",
+    }
+    if not all([settings["server"], settings["username"], settings["password"], settings["sender"]]):
+        return None
+    return settings
 
+def otp_email(otp: str):
+    """Subject and body of the registration OTP email."""
     body = f"""
     Hello,
 
@@ -44,40 +51,13 @@ def send_otp_email(recipient_email: str, otp: str):
     Thank you,
     Poker Night Team
     """
-    msg.attach(MIMEText(body, 'plain'))
-
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls() # Secure the connection
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
-        print(f"OTP email sent to {recipient_email}")
-        return True
-    except Exception as e:
-        print(f"Failed to send OTP email to {recipient_email}: {e}")
-        return False
-
-def send_password_reset_email(recipient_email: str, username: str, reset_token: str):
-    """Sends a password reset link to the recipient's email address."""
-    SMTP_SERVER = os.getenv("SMTP_SERVER")
-    SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-    SMTP_USERNAME = os.getenv("SMTP_USERNAME")
-    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-    SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-
-    if not all([SMTP_SERVER, SMTP_USERNAME, SMTP_PASSWORD, SENDER_EMAIL]):
-        print("Email sending skipped: SMTP configuration missing in environment variables.")
-        print(f"Recipient: {recipient_email}, Reset Token: {reset_token}")
-        return False
+    return "Your One-Time Password (OTP) for Registration", body
 
+def password_reset_email(username: str, reset_token: str):
+    """Subject and body of the password reset email."""
     # Assuming your frontend is running on http://localhost:3000
     reset_link = f"http://localhost:3000/reset-password?token={reset_token}"
 
-    msg = MIMEMultipart()
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = recipient_email
-    msg['Subject'] = "Password Reset Request"
-
     display_name = username if username else "there"
     body = f"""
     Hello {display_name},
@@ -93,19 +73,276 @@ def send_password_reset_email(recipient_email: str, username: str, reset_token:
     Thank you,
     Poker Night Team
     """
+    return "Password Reset Request", body
+
+def _build_message(sender: str, recipient_email: str, subject: str, body: str):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient_email
+    msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+def _send_now(recipient_email: str, subject: str, body: str, description: str):
+    """Send one email over a fresh SMTP connection (used by the command line tools)."""
+    settings = _smtp_settings()
+    if settings is None:
+        print("Email sending skipped: SMTP configuration missing in environment variables.")
+        print(f"Recipient: {recipient_email}, {description}")
+        return False
 
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls() # Secure the connection
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
-        print(f"Password reset email sent to {recipient_email}")
+        with smtplib.SMTP(settings["server"], settings["port"]) as server:
+            if settings["starttls"]:
+                server.starttls() # Secure the connection
+            server.login(settings["username"], settings["password"])
+            server.send_message(_build_message(settings["sender"], recipient_email, subject, body))
+        print(f"Email '{subject}' sent to {recipient_email}")
         return True
     except Exception as e:
-        print(f"Failed to send password reset email to {recipient_email}: {e}")
+        print(f"Failed to send email '{subject}' to {recipient_email}: {e}")
         return False
 
+def send_otp_email(recipient_email: str, otp: str):
+    """Sends an OTP to the recipient's email address."""
+    subject, body = otp_email(otp)
+    return _send_now(recipient_email, subject, body, f"OTP: {otp}")
+
+def send_password_reset_email(recipient_email: str, username: str, reset_token: str):
+    """Sends a password reset link to the recipient's email address."""
+    subject, body = password_reset_email(username, reset_token)
+    return _send_now(recipient_email, subject, body, f"Reset Token: {reset_token}")
+
+# Outbound mail queue
+#
+# Endpoints do not talk to SMTP. They add an OutboundEmail row in the same transaction as the change
+# that triggered it (e.g. storing a new OTP) and return. The rows live in the database, so nothing is
+# lost on restart. Background workers started with the app claim due rows in batches, send each
+# batch over a pooled, already authenticated SMTP connection and delete the sent rows. Failed sends
+# are retried with exponential backoff until MAIL_MAX_ATTEMPTS, after which the row is kept with
+# next_attempt_at = None for inspection. Its body is replaced at that point: OTP and reset emails carry
+# the code in plain text, which auth_tokens otherwise only stores hashed.
+#
+# A claimed batch is leased for MAIL_LEASE_SECONDS. SMTP timeouts can make a batch take longer than
+# that, so the lease is renewed every third of it while the batch is being sent. Only a worker that
+# died stops renewing, and its batch becomes due again once the lease runs out.
+MAIL_QUEUE_WORKERS = int(os.getenv("MAIL_QUEUE_WORKERS", 2))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 8))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", 5))
+MAIL_RETRY_MAX_SECONDS = float(os.getenv("MAIL_RETRY_MAX_SECONDS", 3600))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", 10))
+MAIL_LEASE_SECONDS = float(os.getenv("MAIL_LEASE_SECONDS", 120)) # How long a claimed batch is hidden from other workers
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", 60)) # Idle connections are checked with NOOP before reuse
+DEAD_LETTER_BODY = "[Removed when delivery was given up, it may have contained a one-time code]"
+
+def queue_email(db: AsyncSession, recipient_email: str, subject: str, body: str):
+    """Add an email to the outbound queue. It is sent once the caller commits."""
+    now = datetime.utcnow()
+    db.add(models.OutboundEmail(recipient=recipient_email, subject=subject, body=body, attempts=0, next_attempt_at=now, created_at=now))
+
+def queue_otp_email(db: AsyncSession, recipient_email: str, otp: str):
+    subject, body = otp_email(otp)
+    queue_email(db, recipient_email, subject, body)
+
+def queue_password_reset_email(db: AsyncSession, recipient_email: str, username: str, reset_token: str):
+    subject, body = password_reset_email(username, reset_token)
+    queue_email(db, recipient_email, subject, body)
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff, in seconds, after the given number of failed attempts."""
+    return min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+
+class SMTPConnectionPool:
+    """Reusable authenticated SMTP connections. Blocking, meant to be used from worker threads."""
+
+    def __init__(self, settings: dict, max_idle_seconds: float = SMTP_IDLE_SECONDS):
+        self.settings = settings
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = [] # (last_used, connection)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.settings["server"], self.settings["port"], timeout=30)
+        if self.settings["starttls"]:
+            server.starttls() # Secure the connection
+        server.login(self.settings["username"], self.settings["password"])
+        return server
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                last_used, server = self._idle.pop()
+            if time.monotonic() - last_used < self.max_idle_seconds:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            self.discard(server)
+        return self._connect()
+
+    def release(self, server):
+        with self._lock:
+            self._idle.append((time.monotonic(), server))
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, server in idle:
+            self.discard(server)
+
+class MailQueue:
+    """Background workers draining the outbound_emails table."""
+
+    def __init__(self, workers: int = MAIL_QUEUE_WORKERS, batch_size: int = MAIL_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._smtp_pool: Optional[SMTPConnectionPool] = None
+
+    def start(self):
+        settings = _smtp_settings()
+        self._smtp_pool = SMTPConnectionPool(settings) if settings else None
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._smtp_pool is not None:
+            self._smtp_pool.close()
+
+    def wake(self):
+        """Tell the workers that new mail was committed, instead of waiting for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            try:
+                sent_batch = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Mail queue worker error: {e}")
+                sent_batch = False
+            if sent_batch:
+                continue # More mail may be due, keep going without waiting
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=MAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> bool:
+        """Claim and send one batch of due emails. Returns False when nothing was due."""
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            due = select(models.OutboundEmail.id).where(
+                models.OutboundEmail.next_attempt_at <= now
+            ).order_by(models.OutboundEmail.id).limit(self.batch_size)
+            # Claiming pushes next_attempt_at past the lease, so other workers and processes skip the batch
+            claimed = (await db.execute(
+                update(models.OutboundEmail)
+                .where(models.OutboundEmail.id.in_(due.scalar_subquery()), models.OutboundEmail.next_attempt_at <= now)
+                .values(next_attempt_at=now + timedelta(seconds=MAIL_LEASE_SECONDS), attempts=models.OutboundEmail.attempts + 1)
+                .returning(models.OutboundEmail.id, models.OutboundEmail.recipient, models.OutboundEmail.subject,
+                           models.OutboundEmail.body, models.OutboundEmail.attempts)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+            if not claimed:
+                return False
+
+            renewal = asyncio.create_task(self._renew_lease([email.id for email in claimed]))
+            try:
+                results = await asyncio.to_thread(self._send_batch, claimed)
+            finally:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+
+            sent_ids = [email.id for email in claimed if results[email.id] is None]
+            if sent_ids:
+                await db.execute(delete(models.OutboundEmail).where(models.OutboundEmail.id.in_(sent_ids)))
+            for email in claimed:
+                error = results[email.id]
+                if error is None:
+                    continue
+                give_up = email.attempts >= MAIL_MAX_ATTEMPTS
+                next_attempt_at = None if give_up else datetime.utcnow() + timedelta(seconds=retry_delay(email.attempts))
+                await db.execute(
+                    update(models.OutboundEmail)
+                    .where(models.OutboundEmail.id == email.id)
+                    .values(next_attempt_at=next_attempt_at, last_error=error[:500],
+                            **({"body": DEAD_LETTER_BODY} if give_up else {}))
+                )
+                print(f"Failed to send email '{email.subject}' to {email.recipient} (attempt {email.attempts}): {error}"
+                      + (", giving up" if give_up else ""))
+            await db.commit()
+        return True
+
+    async def _renew_lease(self, ids: list):
+        """Keep a claimed batch hidden from other workers for as long as it is being sent."""
+        while True:
+            await asyncio.sleep(MAIL_LEASE_SECONDS / 3)
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(models.OutboundEmail)
+                        .where(models.OutboundEmail.id.in_(ids), models.OutboundEmail.next_attempt_at.is_not(None))
+                        .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=MAIL_LEASE_SECONDS))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                print(f"Could not renew the lease of {len(ids)} email(s): {e}")
+
+    def _send_batch(self, emails) -> dict:
+        """Send a batch over one pooled connection. Returns {email id: None on success or the error message}."""
+        if self._smtp_pool is None:
+            for email in emails:
+                print("Email sending skipped: SMTP configuration missing in environment variables.")
+                print(f"Recipient: {email.recipient}, Subject: {email.subject}\n{email.body}")
+            return {email.id: None for email in emails}
+
+        results = {}
+        server = None
+        for email in emails:
+            try:
+                if server is None:
+                    server = self._smtp_pool.acquire()
+                message = _build_message(self._smtp_pool.settings["sender"], email.recipient, email.subject, email.body)
+                server.send_message(message)
+                results[email.id] = None
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                results[email.id] = str(e) # Only this message was rejected, the connection is still usable
+            except Exception as e:
+                results[email.id] = str(e)
+                if server is not None:
+                    self._smtp_pool.discard(server)
+                    server = None
+        if server is not None:
+            self._smtp_pool.release(server)
+        return results
+
+mail_queue = MailQueue()
+
 # Example usage (for testing purposes, not part of the main app logic)
 if __name__ == "__main__":
     # For testing, set these environment variables or replace with actual values
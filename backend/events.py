@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Set
+
+# Live updates for the gallery and the voting page. Write endpoints publish small deltas after they
+# commit ("image 12 now has 31 likes") and every connected browser receives them over a server-sent
+# events stream (GET /events), so nobody has to re-pull the whole feed after each click.
+#
+# The bus below is in-process: it only reaches clients connected to the same worker. A broker backed
+# bus (Redis pub/sub, Postgres LISTEN/NOTIFY, ...) can replace it by implementing the same
+# publish / subscribe / close interface and assigning it to `bus`.
+#
+# uvicorn waits for open connections before it runs the lifespan shutdown, so a stream cannot rely on
+# bus.close() to end. Every stream ends on its own after EVENTS_STREAM_MAX_SECONDS and tells the client
+# to reconnect after EVENTS_RETRY_MS: a server that is shutting down drains within that time.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 256))
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+EVENTS_STREAM_MAX_SECONDS = float(os.getenv("EVENTS_STREAM_MAX_SECONDS", 60))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+
+# Sent to a subscriber that fell too far behind, its client should refetch instead of applying deltas
+RESYNC = {"type": "resync"}
+
+class Subscription:
+    """The queue of events waiting to be sent to one client."""
+
+    def __init__(self, max_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event: Optional[dict]):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Never block publishers on a slow client: drop its backlog and ask it to resync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, RESYNC, None once the bus closed. Raises asyncio.TimeoutError when idle."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+class InProcessEventBus:
+    """Fan-out of published events to every subscription of this process."""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions: Set[Subscription] = set()
+
+    def publish(self, event: dict):
+        """Deliver an event to every subscriber. Never blocks."""
+        for subscription in list(self._subscriptions):
+            subscription.put(event)
+
+    @asynccontextmanager
+    async def subscribe(self) -> AsyncIterator[Subscription]:
+        subscription = Subscription(self.queue_size)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+    def close(self):
+        """End every open stream, for servers that run the shutdown before closing connections."""
+        for subscription in list(self._subscriptions):
+            subscription.put(None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+bus = InProcessEventBus()
+
+def publish(event_type: str, **data):
+    bus.publish({"type": event_type, **data})
+
+def format_sse(event: dict) -> bytes:
+    data = {key: value for key, value in event.items() if key != "type"}
+    return f"event: {event['type']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+async def stream(keepalive_seconds: float = EVENTS_KEEPALIVE_SECONDS,
+                 max_seconds: float = EVENTS_STREAM_MAX_SECONDS) -> AsyncIterator[bytes]:
+    """Server-sent events body for one client. Ends after max_seconds, when the bus closes or the client disconnects."""
+    deadline = time.monotonic() + max_seconds
+    async with bus.subscribe() as subscription:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n".encode() # Reconnect delay for EventSource
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = await subscription.get(min(keepalive_seconds, remaining))
+            except asyncio.TimeoutError:
+                if time.monotonic() < deadline:
+                    yield b": keepalive\n\n" # Keeps proxies from closing an idle stream
+                continue
+            if event is None:
+                return
+            yield format_sse(event)
@@ -0,0 +1,26 @@
+from typing import Any, List
+
+import orjson
+from fastapi import Response
+
+from . import instrumentation
+
+# List endpoints select plain column tuples and serialize them straight to JSON with orjson, instead
+# of validating every ORM object against its orm_mode response model first. The routes keep their
+# response_model for the OpenAPI schema, the rows must therefore be shaped exactly like that model
+# (same keys, in the same order). backend/bench_serialization.py measures the difference.
+
+def dumps(content: Any) -> bytes:
+    with instrumentation.serializing():
+        return orjson.dumps(content)
+
+def rows_as_dicts(result) -> List[dict]:
+    """Turn a SQLAlchemy result of labelled columns into a list of dicts."""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -5,24 +5,30 @@ import sys
 # Add the parent directory to sys.path to allow importing backend modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from backend.database import Base, engine, DATABASE_URL
+from backend.database import Base, engine
 from backend.models import User, Registration, Image, Reaction # Import all models
+from backend import migrations
 
 def initialize_database():
     print("Attempting to create database tables...")
     
-    # Extract the file path from the DATABASE_URL
-    # Assuming DATABASE_URL is in the format "sqlite:///path/to/db.db"
-    db_file_path = DATABASE_URL.replace("sqlite:///", "")
-    
-    # Delete existing database file if it exists
-    if os.path.exists(db_file_path):
-        print(f"Deleting existing database file: {db_file_path}")
-        os.remove(db_file_path)
+    if engine.url.get_backend_name() == "sqlite":
+        db_file_path = engine.url.database
+        
+        # Delete existing database file (and its WAL files) if it exists
+        for path in (db_file_path, f"{db_file_path}-wal", f"{db_file_path}-shm"):
+            if os.path.exists(path):
+                print(f"Deleting existing database file: {path}")
+                os.remove(path)
+    else:
+        # Other backends (e.g. Postgres) cannot be deleted as a file, drop the tables instead
+        print(f"Dropping existing tables in {engine.url.render_as_string(hide_password=True)}")
+        Base.metadata.drop_all(bind=engine)
     
     Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine) # Record the migrations as applied, the fresh schema already includes them
     print("Database tables created successfully (if they didn't exist).")
-    print(f"Database file path: {db_file_path}")
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
 
 if __name__ == "__main__":
     initialize_database()
@@ -0,0 +1,204 @@
+import hmac
+import os
+import re
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+# Where does the time of a request go? InstrumentationMiddleware records, per request, the wall time,
+# the number and total time of the SQL statements it ran (cursor events on the engines, see
+# instrument_engine) and the time spent serializing JSON (fast_json.dumps). Every response gets a
+# Server-Timing header (shown in the browser's network panel), and the totals per route are exposed
+# in the Prometheus text format by GET /metrics. The route names and timings are not for the public:
+# /metrics only answers requests with "Authorization: Bearer <METRICS_TOKEN>" and is off (404) while
+# METRICS_TOKEN is not set.
+#
+# QUERY_BUDGET flags requests that run more than that many statements, the usual sign of an N+1
+# loop. "log" prints the route and its most repeated statement, "raise" fails the request at the
+# statement that goes over the budget, for smoke tests and check scripts.
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 0)) # 0 disables the check
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+class RequestMetrics:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements: Counter = Counter() # Statement text -> times run, to name the N+1 culprit
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+def current() -> Optional[RequestMetrics]:
+    """The metrics of the request being handled, None outside a request."""
+    return _current.get()
+
+@contextmanager
+def serializing():
+    """Count the time spent in the block as serialization of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_seconds += time.perf_counter() - start
+
+def instrument_engine(sync_engine):
+    """Time every statement run on an engine (pass async_engine.sync_engine for an async one)."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = _current.get()
+        if metrics is None:
+            return
+        metrics.queries += 1
+        metrics.statements[statement] += 1
+        if QUERY_BUDGET and QUERY_BUDGET_MODE == "raise" and metrics.queries > QUERY_BUDGET:
+            raise QueryBudgetExceeded(f"More than {QUERY_BUDGET} statements in one request, the last one: {' '.join(statement.split())}")
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = _current.get()
+        started = conn.info.get("query_started")
+        if metrics is not None and started:
+            metrics.sql_seconds += time.perf_counter() - started.pop()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def on_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+class Registry:
+    """Totals per route, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.requests: Counter = Counter() # (method, route, status) -> requests
+        self.durations: Dict[Tuple[str, str], list] = {} # (method, route) -> [bucket counts..., sum, count]
+        self.queries: Counter = Counter() # (method, route) -> statements
+        self.sql_seconds: Counter = Counter()
+        self.serialize_seconds: Counter = Counter()
+        self.over_budget: Counter = Counter() # (method, route) -> requests over QUERY_BUDGET
+        self.flagged: Deque[dict] = deque(maxlen=100) # The latest requests over QUERY_BUDGET
+
+    def observe(self, method: str, route: str, status_code: int, metrics: RequestMetrics, elapsed: float):
+        key = (method, route)
+        self.requests[(method, route, status_code)] += 1
+        histogram = self.durations.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if elapsed <= bound:
+                histogram[i] += 1
+        histogram[-2] += elapsed
+        histogram[-1] += 1
+        self.queries[key] += metrics.queries
+        self.sql_seconds[key] += metrics.sql_seconds
+        self.serialize_seconds[key] += metrics.serialize_seconds
+        if QUERY_BUDGET and metrics.queries > QUERY_BUDGET:
+            self.over_budget[key] += 1
+            statement, times = metrics.statements.most_common(1)[0]
+            self.flagged.append({"method": method, "route": route, "queries": metrics.queries,
+                                 "most_repeated": " ".join(statement.split()), "times": times})
+            print(f"Query budget exceeded: {method} {route} ran {metrics.queries} statements "
+                  f"(budget {QUERY_BUDGET}), {times}x: {' '.join(statement.split())}")
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        family("http_requests_total", "counter", "HTTP requests by route and status.", [
+            f'http_requests_total{{method="{m}",route="{_escape(r)}",status="{s}"}} {n}' for (m, r, s), n in sorted(self.requests.items())
+        ])
+        duration_samples = []
+        for (m, r), histogram in sorted(self.durations.items()):
+            labels = f'method="{m}",route="{_escape(r)}"'
+            for bound, count in zip(DURATION_BUCKETS, histogram):
+                duration_samples.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            duration_samples.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-1]}')
+            duration_samples.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram[-2]:.6f}")
+            duration_samples.append(f"http_request_duration_seconds_count{{{labels}}} {histogram[-1]}")
+        family("http_request_duration_seconds", "histogram", "Wall time until the response headers were sent.", duration_samples)
+        for name, help_text, counter, fmt in (
+            ("db_queries_total", "SQL statements run by requests.", self.queries, "{}"),
+            ("db_query_seconds_total", "Time requests spent in SQL statements.", self.sql_seconds, "{:.6f}"),
+            ("serialization_seconds_total", "Time requests spent serializing JSON.", self.serialize_seconds, "{:.6f}"),
+            ("query_budget_exceeded_total", "Requests that ran more than QUERY_BUDGET statements.", self.over_budget, "{}"),
+        ):
+            family(name, "counter", help_text, [
+                f'{name}{{method="{m}",route="{_escape(r)}"}} {fmt.format(value)}' for (m, r), value in sorted(counter.items())
+            ])
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return re.sub(r'(["\\])', r"\\\1", value).replace("\n", "\\n")
+
+registry = Registry()
+
+def metrics_authorized(authorization: str) -> bool:
+    """Whether an Authorization header carries METRICS_TOKEN."""
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+def _route(scope) -> str:
+    """The route template ("/images/{image_id}/like"), so ids do not become label values."""
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+
+class InstrumentationMiddleware:
+    """Measure every HTTP request, add Server-Timing and feed the registry."""
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not INSTRUMENTATION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        status_code = 500
+        elapsed = None
+
+        async def timed_send(message):
+            nonlocal status_code, elapsed
+            if message["type"] == "http.response.start":
+                # Streaming responses keep running: their timing covers the work before the first byte
+                status_code = message["status"]
+                elapsed = metrics.elapsed
+                timing = (f'db;dur={metrics.sql_seconds * 1000:.2f};desc="{metrics.queries} queries", '
+                          f"serialize;dur={metrics.serialize_seconds * 1000:.2f}, total;dur={elapsed * 1000:.2f}")
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            self.registry.observe(scope["method"], _route(scope), status_code, metrics, elapsed if elapsed is not None else metrics.elapsed)
@@ -1,13 +1,15 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Body
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, HTTPException, status, Body, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from datetime import datetime, timedelta
-from typing import Optional, List
-from sqlalchemy.orm import Session
+from datetime import timedelta
+from typing import Optional, List, Dict
+from sqlalchemy import func, exists, select, delete, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr, constr
 import random
 import string
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 import os
 
@@ -17,14 +19,44 @@ load_dotenv(dotenv_path=dotenv_path)
 
 
 
-from . import auth_utils, models, database, email_utils
+from . import auth_utils, models, database, email_utils, stats, toggles, migrations, uploads, variants, static_files, backgrounds, events, registrations_io, rate_limit, auth_tokens, write_buffer, instrumentation
+from .response_cache import response_cache
+from .fast_json import ORJSONResponse, rows_as_dicts
 from .database import engine
 
 models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
-
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+migrations.upgrade(engine)
+
+# Count and time the SQL statements of every request (see instrumentation.py)
+for instrumented_engine in {engine, database.async_engine.sync_engine, database.read_async_engine.sync_engine}:
+    instrumentation.instrument_engine(instrumented_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    email_utils.mail_queue.start()
+    auth_tokens.sweeper.start()
+    write_buffer.buffer.start()
+    await auth_utils.password_hash_pool.start()
+    yield
+    await write_buffer.buffer.stop() # Writes the pending likes and reactions
+    events.bus.close()
+    await auth_tokens.sweeper.stop()
+    await email_utils.mail_queue.stop()
+    auth_utils.password_hash_pool.shutdown()
+    variants.pipeline.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+static = static_files.CachedStaticFiles(directory="uploads")
+app.mount("/static", static, name="static")
+
+# Throttle OTP requests and login attempts before any database or hashing work (see rate_limit.py).
+# Added before CORS so that 429 responses still carry the CORS headers.
+app.add_middleware(rate_limit.RateLimitMiddleware)
+
+# Enforce the upload size limit while the body streams in. Added before CORS, like the rate limiter,
+# so that 413 responses still carry the CORS headers.
+app.add_middleware(uploads.UploadSizeLimitMiddleware, path="/images/")
 
 # CORS middleware
 app.add_middleware(
@@ -35,6 +67,9 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Outermost, so the timings include the other middlewares
+app.add_middleware(instrumentation.InstrumentationMiddleware)
+
 class UserCreate(BaseModel):
     email: EmailStr
     username: constr(min_length=3)
@@ -50,56 +85,51 @@ class SimplifiedRegistrationBody(BaseModel):
     password: Optional[str] = None
 
 @app.post("/register_simplified/", status_code=status.HTTP_200_OK)
-async def register_simplified(body: SimplifiedRegistrationBody, db: Session = Depends(database.get_db)):
+async def register_simplified(body: SimplifiedRegistrationBody, db: AsyncSession = Depends(database.get_db)):
     # Case 1: Requesting OTP
     if not body.otp and not body.username and not body.password:
-        user = db.query(models.User).filter(models.User.email == body.email).first()
+        user = (await db.execute(select(models.User).where(models.User.email == body.email))).scalars().first()
         if user and user.username: # User exists and is fully registered
             raise HTTPException(status_code=400, detail="Email already registered.")
 
         otp = ''.join(random.choices(string.digits, k=6))
-        otp_expires_at = datetime.utcnow() + timedelta(minutes=10)
 
         if not user: # New user
-            new_user = models.User(
+            user = models.User(
                 email=body.email,
-                otp=otp,
-                otp_expires_at=otp_expires_at,
                 password_change_required=True
             )
-            db.add(new_user)
-        else: # User exists but is not fully registered
-            user.otp = otp
-            user.otp_expires_at = otp_expires_at
-
-        db.commit()
+            db.add(user)
+            await db.flush() # Assigns the id the OTP row refers to
+        # Replaces any earlier OTP of a user that is not fully registered
+        await auth_tokens.issue(db, user.id, auth_tokens.OTP_PURPOSE, otp, auth_tokens.OTP_TTL)
 
-        try:
-            email_utils.send_otp_email(body.email, otp)
-            return {"message": "OTP sent to your email."}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to send OTP email: {e}")
+        # The email is committed together with the OTP and sent by the mail queue workers
+        email_utils.queue_otp_email(db, body.email, otp)
+        await db.commit()
+        email_utils.mail_queue.wake()
+        return {"message": "OTP sent to your email."}
 
     # Case 2: Verifying OTP and completing registration
     elif body.otp and body.username and body.password:
-        user = db.query(models.User).filter(models.User.email == body.email).first()
+        user = (await db.execute(select(models.User).where(models.User.email == body.email))).scalars().first()
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found. Please request an OTP first.")
 
-        if user.otp != body.otp or user.otp_expires_at < datetime.utcnow():
+        # Deleting the OTP row is the check, a code can only be used once (an error below rolls it back)
+        if not await auth_tokens.consume(db, user.id, auth_tokens.OTP_PURPOSE, body.otp):
             raise HTTPException(status_code=400, detail="Invalid or expired OTP.")
 
-        existing_user = db.query(models.User).filter(models.User.username == body.username).first()
+        existing_user = (await db.execute(select(models.User.id).where(models.User.username == body.username))).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Username is already taken.")
 
         user.username = body.username
-        user.hashed_password = auth_utils.get_password_hash(body.password)
-        user.otp = None
-        user.otp_expires_at = None
+        user.hashed_password = await auth_utils.get_password_hash_async(body.password)
         user.password_change_required = False
-        db.commit()
+        await db.commit()
+        auth_utils.invalidate_user(user.id)
 
         return {"message": "Registration successful! You can now log in."}
 
@@ -109,8 +139,8 @@ async def register_simplified(body: SimplifiedRegistrationBody, db: Session = De
 
 
 @app.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = auth_utils.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_db)):
+    user = await auth_utils.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,100 +166,205 @@ class RegistrationInfo(RegistrationData):
         orm_mode = True
 
 from fastapi import FastAPI, Depends, HTTPException, status, Body, File, UploadFile, Response
-import shutil
-from sqlalchemy.orm import joinedload
 
 # Create uploads directory if it doesn't exist
 UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-class ReactionInfo(BaseModel):
-    id: int
-    emoji: str
-    user_id: int
-    image_id: int
-
-    class Config:
-        orm_mode = True
-
-class LikeInfo(BaseModel):
-    id: int
-    user_id: int
-    image_id: int
-
-    class Config:
-        orm_mode = True
-
 class ImageInfo(BaseModel):
     id: int
     filename: str
     caption: str
     user_id: int
-    reactions: List[ReactionInfo] = [] # Include reactions
-    likes: List[LikeInfo] = [] # Include likes
+    like_count: int = 0 # Aggregated in SQL, the individual likes are never loaded
+    reaction_counts: Dict[str, int] = {} # emoji -> number of reactions
     has_liked: bool = False # New field to indicate if current user has liked
+    srcset: Dict[str, str] = {} # Resized variants per format ("avif", "webp"), empty until they are rendered
 
     class Config:
         orm_mode = True
 
+class ImagePage(BaseModel):
+    items: List[ImageInfo]
+    next_cursor: Optional[int] = None # Pass as `after` to fetch the next page, None on the last page
+
+IMAGE_PAGE_DEFAULT_LIMIT = 24
+IMAGE_PAGE_MAX_LIMIT = 100
+# Tables the gallery listing is built from, a write to any of them invalidates cached pages
+IMAGE_LIST_TABLES = ("images", "image_stats", "image_reaction_counts", "likes", "image_variants")
+
 @app.post("/images/", response_model=ImageInfo, status_code=status.HTTP_201_CREATED)
-async def upload_image(file: UploadFile = File(...), caption: str = Body(...), db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.admin_required)):
-    file_path = os.path.join(UPLOADS_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def upload_image(file: UploadFile = File(...), caption: str = Body(...), db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.admin_required)):
+    # Stored under its content hash, identical photos share one file
+    filename = await uploads.store_upload(file, UPLOADS_DIR)
 
-    new_image = models.Image(filename=file.filename, caption=caption, owner=current_user)
+    new_image = models.Image(filename=filename, caption=caption, user_id=current_user.id)
     db.add(new_image)
-    db.commit()
-    db.refresh(new_image)
+    await db.commit()
+    await db.refresh(new_image)
+
+    # Thumbnails and responsive variants are rendered in the background
+    variants.pipeline.schedule(new_image.id, UPLOADS_DIR, filename)
     return new_image
 
-@app.get("/images/", response_model=List[ImageInfo])
-async def get_images(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    images = db.query(models.Image).options(joinedload(models.Image.reactions), joinedload(models.Image.likes)).all()
-    # For each image, add a 'has_liked' field indicating if the current user has liked it
-    for image in images:
-        image.has_liked = any(like.user_id == current_user.id for like in image.likes)
-    return images
+@app.get("/images/", response_model=ImagePage)
+async def get_images(request: Request, limit: int = Query(IMAGE_PAGE_DEFAULT_LIMIT, ge=1, le=IMAGE_PAGE_MAX_LIMIT), after: Optional[int] = None, db: AsyncSession = Depends(database.get_read_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    # Cached per user (has_liked differs), see response_cache.py
+    async def build():
+        # Keyset pagination on the image id: counts come from the denormalized image_stats table (see stats.py)
+        has_liked = exists().where(models.Like.image_id == models.Image.id, models.Like.user_id == current_user.id)
+
+        query = select(
+            models.Image.id,
+            models.Image.filename,
+            models.Image.caption,
+            models.Image.user_id,
+            func.coalesce(models.ImageStats.like_count, 0).label("like_count"),
+            has_liked.label("has_liked"),
+        ).outerjoin(models.ImageStats, models.ImageStats.image_id == models.Image.id)
+        if after is not None:
+            query = query.where(models.Image.id > after)
+        # Fetch one extra row to know whether another page follows
+        rows = (await db.execute(query.order_by(models.Image.id).limit(limit + 1))).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        rows = rows[:limit]
+
+        # One query for the per-emoji counters of the whole page
+        reaction_counts: Dict[int, Dict[str, int]] = {}
+        if rows:
+            counts = await db.execute(
+                select(models.ImageReactionCount.image_id, models.ImageReactionCount.emoji, models.ImageReactionCount.count)
+                .where(models.ImageReactionCount.image_id.in_([row.id for row in rows]))
+            )
+            for image_id, emoji, count in counts:
+                reaction_counts.setdefault(image_id, {})[emoji] = count
+        srcsets = await variants.srcsets_for(db, [row.id for row in rows], lambda path: str(request.url_for("static", path=path)))
+        # Likes and reactions still waiting in the write buffer (empty unless it is enabled)
+        like_delta, liked, reaction_delta = write_buffer.buffer.overlay(current_user.id, [row.id for row in rows])
+        for image_id, deltas in reaction_delta.items():
+            counts = reaction_counts.setdefault(image_id, {})
+            for emoji, delta in deltas.items():
+                counts[emoji] = counts.get(emoji, 0) + delta
+                if counts[emoji] <= 0:
+                    del counts[emoji]
+
+        # Plain dicts shaped like ImageInfo, serialized by orjson (see fast_json.py)
+        items = [
+            {
+                "id": row.id,
+                "filename": row.filename,
+                "caption": row.caption,
+                "user_id": row.user_id,
+                "like_count": row.like_count + like_delta.get(row.id, 0),
+                "reaction_counts": reaction_counts.get(row.id, {}),
+                "has_liked": liked.get(row.id, bool(row.has_liked)),
+                "srcset": srcsets.get(row.id, {}),
+            }
+            for row in rows
+        ]
+        return {"items": items, "next_cursor": next_cursor}
+
+    return await response_cache.respond(request, IMAGE_LIST_TABLES, build, user_id=current_user.id)
 
 @app.delete("/images/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_image(image_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.admin_required)):
-    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
+async def delete_image(image_id: int, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.admin_required)):
+    db_image = await db.get(models.Image, image_id)
     if db_image is None:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    # Optional: Delete the actual file from the uploads directory
+    await stats.delete_image_stats(db, image_id)
+    await db.execute(delete(models.ImageVariant).where(models.ImageVariant.image_id == image_id))
+    await db.delete(db_image)
+    await db.commit()
+
+    # Delete the file from the uploads directory unless another image (same content) still uses it
+    still_used = (await db.execute(select(models.Image.id).where(models.Image.filename == db_image.filename).limit(1))).first()
     file_path = os.path.join(UPLOADS_DIR, db_image.filename)
-    if os.path.exists(file_path):
+    if not still_used and os.path.exists(file_path):
         os.remove(file_path)
-
-    db.delete(db_image)
-    db.commit()
+    if not still_used:
+        variants.delete_variant_files(UPLOADS_DIR, db_image.filename)
     return {"ok": True}
 
 class UserPublic(BaseModel):
     id: int
-    username: str
+    username: Optional[str] = None # None until a simplified registration is completed
     email: EmailStr
     is_admin: bool
 
     class Config:
         orm_mode = True
 
-@app.get("/users/", response_model=List[UserPublic])
-async def get_users(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.admin_required)):
-    users = db.query(models.User).all()
-    return users
+# The admin listings page by id (keyset, no OFFSET) and report how many rows match. Counting stops
+# at ADMIN_COUNT_CAP rows so the count stays cheap on large tables, total_exact tells the two apart.
+ADMIN_PAGE_DEFAULT_LIMIT = 50
+ADMIN_PAGE_MAX_LIMIT = 200
+ADMIN_COUNT_CAP = int(os.getenv("ADMIN_COUNT_CAP", 10000))
+
+def _next_character(character: str) -> Optional[str]:
+    """The following code point, skipping surrogates (not encodable), None after U+10FFFF."""
+    code = ord(character) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return chr(code) if code <= 0x10FFFF else None
+
+def _prefix_match(column, prefix: str):
+    """column starts with prefix, as a range the column's index can serve (SQLite's LIKE cannot use it)."""
+    # The upper bound bumps the last character; trailing U+10FFFF cannot be bumped and is dropped
+    stem = prefix
+    while stem and _next_character(stem[-1]) is None:
+        stem = stem[:-1]
+    if not stem:
+        return column >= prefix
+    return and_(column >= prefix, column < stem[:-1] + _next_character(stem[-1]))
+
+async def _capped_count(db: AsyncSession, ids_query):
+    """Count the rows of a single column select, stopping at ADMIN_COUNT_CAP. Returns (count, exact)."""
+    count = await db.scalar(select(func.count()).select_from(ids_query.limit(ADMIN_COUNT_CAP).subquery()))
+    return count, count < ADMIN_COUNT_CAP
+
+class UserPage(BaseModel):
+    items: List[UserPublic]
+    next_cursor: Optional[int] = None # Pass as `after` to fetch the next page, None on the last page
+    total_estimate: int # Matching users, capped at ADMIN_COUNT_CAP
+    total_exact: bool
+
+@app.get("/users/", response_model=UserPage)
+async def get_users(
+    request: Request,
+    limit: int = Query(ADMIN_PAGE_DEFAULT_LIMIT, ge=1, le=ADMIN_PAGE_MAX_LIMIT),
+    after: Optional[int] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Username or email prefix (case sensitive)"),
+    is_admin: Optional[bool] = None,
+    db: AsyncSession = Depends(database.get_read_db),
+    current_user: auth_utils.Principal = Depends(auth_utils.admin_required),
+):
+    conditions = []
+    if q:
+        conditions.append(or_(_prefix_match(models.User.username, q), _prefix_match(models.User.email, q)))
+    if is_admin is not None:
+        conditions.append(models.User.is_admin == is_admin)
+
+    async def build():
+        query = select(models.User.id, models.User.username, models.User.email, models.User.is_admin).where(*conditions)
+        if after is not None:
+            query = query.where(models.User.id > after)
+        rows = rows_as_dicts(await db.execute(query.order_by(models.User.id).limit(limit + 1)))
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        total, exact = await _capped_count(db, select(models.User.id).where(*conditions))
+        return {"items": rows[:limit], "next_cursor": next_cursor, "total_estimate": total, "total_exact": exact}
+    return await response_cache.respond(request, ("users",), build)
 
 @app.put("/users/{user_id}/set-admin", response_model=UserPublic)
-async def set_user_admin_status(user_id: int, is_admin: bool, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.admin_required)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def set_user_admin_status(user_id: int, is_admin: bool, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.admin_required)):
+    user = await db.get(models.User, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     user.is_admin = is_admin
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    auth_utils.invalidate_user(user.id)
     return user
 
 class VoteAdminInfo(BaseModel):
@@ -241,19 +376,72 @@ class VoteAdminInfo(BaseModel):
     class Config:
         orm_mode = True
 
-@app.get("/admin/votes", response_model=List[VoteAdminInfo])
-async def get_all_votes(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.admin_required)):
-    votes = db.query(models.Vote).options(joinedload(models.Vote.owner)).all()
-    return votes
+class VotePage(BaseModel):
+    items: List[VoteAdminInfo]
+    next_cursor: Optional[int] = None # Pass as `after` to fetch the next page, None on the last page
+    total_estimate: int # Matching votes, capped at ADMIN_COUNT_CAP
+    total_exact: bool
+
+@app.get("/admin/votes", response_model=VotePage)
+async def get_all_votes(
+    request: Request,
+    limit: int = Query(ADMIN_PAGE_DEFAULT_LIMIT, ge=1, le=ADMIN_PAGE_MAX_LIMIT),
+    after: Optional[int] = None,
+    month: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Voter username prefix (case sensitive)"),
+    db: AsyncSession = Depends(database.get_read_db),
+    current_user: auth_utils.Principal = Depends(auth_utils.admin_required),
+):
+    conditions = []
+    if month:
+        conditions.append(models.Vote.month == month)
+    if q:
+        conditions.append(_prefix_match(models.User.username, q))
+
+    async def build():
+        query = (
+            select(models.Vote.id, models.Vote.event_date, models.Vote.month,
+                   models.User.id, models.User.username, models.User.email, models.User.is_admin)
+            .join(models.User, models.Vote.user_id == models.User.id)
+            .where(*conditions)
+        )
+        if after is not None:
+            query = query.where(models.Vote.id > after)
+        rows = (await db.execute(query.order_by(models.Vote.id).limit(limit + 1))).all()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        items = [
+            {"id": vote_id, "event_date": event_date, "month": vote_month,
+             "owner": {"id": user_id, "username": username, "email": email, "is_admin": is_admin}}
+            for vote_id, event_date, vote_month, user_id, username, email, is_admin in rows[:limit]
+        ]
+        ids_query = select(models.Vote.id).where(*conditions)
+        if q:
+            ids_query = ids_query.join(models.User, models.Vote.user_id == models.User.id)
+        total, exact = await _capped_count(db, ids_query)
+        return {"items": items, "next_cursor": next_cursor, "total_estimate": total, "total_exact": exact}
+    return await response_cache.respond(request, ("votes", "users"), build)
+
+class BackgroundImage(BaseModel):
+    filename: str
+    path: str # Versioned path under /static, safe to cache forever
+    width: Optional[int] = None
+    height: Optional[int] = None
+    dominant_color: Optional[str] = None # "#rrggbb", placeholder while the image loads
+
+background_catalog = backgrounds.BackgroundCatalog(
+    os.path.join(UPLOADS_DIR, "BackgroundLogin"), "BackgroundLogin", static.versioned_path
+)
 
-@app.get("/backgrounds", response_model=List[str])
-async def get_background_images():
-    background_dir = os.path.join(UPLOADS_DIR, "BackgroundLogin")
-    if not os.path.exists(background_dir):
+@app.get("/backgrounds", response_model=List[BackgroundImage])
+async def get_background_images(request: Request):
+    # Served from the in-memory catalog, see backgrounds.py
+    body, etag = await background_catalog.get()
+    if body is None:
         raise HTTPException(status_code=404, detail="Backgrounds directory not found")
-    
-    images = [f for f in os.listdir(background_dir) if os.path.isfile(os.path.join(background_dir, f))]
-    return images
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 class VoteCreate(BaseModel):
     event_date: str
@@ -266,124 +454,165 @@ class VoteInfo(VoteCreate):
     class Config:
         orm_mode = True
 
+def _vote_columns():
+    """The columns of VoteInfo, in its field order."""
+    return select(models.Vote.event_date, models.Vote.month, models.Vote.id, models.Vote.user_id)
+
 @app.get("/votes/{month}", response_model=List[VoteInfo])
-async def get_votes(month: str, db: Session = Depends(database.get_db)):
-    votes = db.query(models.Vote).filter(models.Vote.month == month).all()
-    return votes
+async def get_votes(month: str, request: Request, db: AsyncSession = Depends(database.get_read_db)):
+    async def build():
+        return rows_as_dicts(await db.execute(_vote_columns().where(models.Vote.month == month)))
+    return await response_cache.respond(request, ("votes",), build)
+
+class VoteSummary(BaseModel):
+    month: str
+    counts: Dict[str, int] # event_date -> number of votes
+    total: int
+    my_votes: List[str] # Event dates the caller voted for
+
+@app.get("/votes/{month}/summary", response_model=VoteSummary)
+async def get_vote_summary(month: str, db: AsyncSession = Depends(database.get_read_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    # Reads the precomputed tallies (one row per date) instead of every Vote of the month
+    tallies = (await db.execute(
+        select(models.VoteTally.event_date, models.VoteTally.count).where(models.VoteTally.month == month)
+    )).all()
+    my_votes = (await db.execute(
+        select(models.Vote.event_date).where(models.Vote.user_id == current_user.id, models.Vote.month == month)
+    )).scalars().all()
+    counts = {event_date: count for event_date, count in tallies}
+    return VoteSummary(month=month, counts=counts, total=sum(counts.values()), my_votes=my_votes)
 
 @app.get("/votes/my-votes", response_model=List[VoteInfo])
-async def get_my_votes(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    votes = db.query(models.Vote).filter(models.Vote.user_id == current_user.id).all()
-    return votes
-
-@app.post("/votes")
-async def cast_vote(vote: VoteCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    # Check if the user has already voted for this exact date
-    existing_vote = db.query(models.Vote).filter(
-        models.Vote.user_id == current_user.id,
-        models.Vote.event_date == vote.event_date
-    ).first()
-
-    if existing_vote:
-        # User has already voted for this date, so we delete the vote (un-vote)
-        db.delete(existing_vote)
-        db.commit()
+async def get_my_votes(db: AsyncSession = Depends(database.get_read_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    return ORJSONResponse(rows_as_dicts(await db.execute(_vote_columns().where(models.Vote.user_id == current_user.id))))
+
+@app.post("/votes", response_model=VoteInfo)
+async def cast_vote(vote: VoteCreate, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    # Voting again for the same date removes the vote (un-vote)
+    new_vote = await toggles.toggle_vote(db, current_user.id, vote.event_date, vote.month)
+    await db.commit()
+    events.publish("vote", month=vote.month, event_date=vote.event_date, count=await stats.vote_count(db, vote.month, vote.event_date))
+    if new_vote is None:
         return Response(status_code=status.HTTP_204_NO_CONTENT)
-    else:
-        # Create a new vote
-        new_vote = models.Vote(**vote.dict(), owner=current_user)
-        db.add(new_vote)
-        db.commit()
-        db.refresh(new_vote)
-        return new_vote
+    return new_vote
 
 @app.post("/images/{image_id}/like", status_code=status.HTTP_204_NO_CONTENT)
-async def like_image(image_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
-    if db_image is None:
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    existing_like = db.query(models.Like).filter(
-        models.Like.user_id == current_user.id,
-        models.Like.image_id == image_id
-    ).first()
+async def like_image(image_id: int, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    if write_buffer.buffer.enabled:
+        # Coalesced with other toggles, written and published by the buffer's flush
+        if await write_buffer.buffer.toggle_like(current_user.id, image_id) is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    if existing_like:
-        db.delete(existing_like)
-    else:
-        new_like = models.Like(user_id=current_user.id, image_id=image_id)
-        db.add(new_like)
+    liked = await toggles.toggle_like(db, current_user.id, image_id)
+    if liked is None:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-    db.commit()
+    await db.commit()
+    # Publish the committed total rather than +1/-1, so a missed or reordered event cannot skew clients
+    events.publish("like", image_id=image_id, like_count=await stats.like_count(db, image_id))
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
+@app.post("/events/ticket")
+async def create_events_ticket(current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    # The access token stays out of the URL (and the access log), see auth_utils.create_stream_ticket
+    return {"ticket": auth_utils.create_stream_ticket(current_user), "expires_in": auth_utils.STREAM_TICKET_EXPIRE_SECONDS}
+
+@app.get("/events")
+async def stream_events(ticket: str = Query(...)):
+    auth_utils.user_id_from_stream_ticket(ticket)
+    return StreamingResponse(
+        events.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 class ReactionBody(BaseModel):
     emoji: str
 
 @app.post("/images/{image_id}/react", status_code=status.HTTP_204_NO_CONTENT)
-async def react_to_image(image_id: int, reaction: ReactionBody, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
-    if db_image is None:
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    # Check if user has already reacted with this emoji to this image
-    existing_reaction = db.query(models.Reaction).filter(
-        models.Reaction.user_id == current_user.id,
-        models.Reaction.image_id == image_id,
-        models.Reaction.emoji == reaction.emoji
-    ).first()
+async def react_to_image(image_id: int, reaction: ReactionBody, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    # Reacting again with the same emoji removes the reaction
+    if write_buffer.buffer.enabled:
+        if await write_buffer.buffer.toggle_reaction(current_user.id, image_id, reaction.emoji) is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    if existing_reaction:
-        db.delete(existing_reaction)
-    else:
-        new_reaction = models.Reaction(
-            emoji=reaction.emoji,
-            user_id=current_user.id,
-            image_id=image_id
-        )
-        db.add(new_reaction)
+    reacted = await toggles.toggle_reaction(db, current_user.id, image_id, reaction.emoji)
+    if reacted is None:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-    db.commit()
+    await db.commit()
+    events.publish("reaction", image_id=image_id, emoji=reaction.emoji, count=await stats.reaction_count(db, image_id, reaction.emoji))
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.get("/registrations/", response_model=List[RegistrationInfo])
-async def get_registrations(db: Session = Depends(database.get_db)):
-    registrations = db.query(models.Registration).all()
-    return registrations
+async def get_registrations(request: Request, db: AsyncSession = Depends(database.get_read_db)):
+    async def build():
+        return rows_as_dicts(await db.execute(select(
+            models.Registration.name, models.Registration.guests, models.Registration.id, models.Registration.user_id
+        )))
+    return await response_cache.respond(request, ("registrations",), build)
 
 @app.post("/registrations/", response_model=RegistrationInfo, status_code=status.HTTP_201_CREATED)
-async def create_registration(registration: RegistrationData, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    new_registration = models.Registration(**registration.dict(), owner=current_user)
+async def create_registration(registration: RegistrationData, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    new_registration = models.Registration(**registration.dict(), user_id=current_user.id)
     db.add(new_registration)
-    db.commit()
-    db.refresh(new_registration)
+    await db.commit()
+    await db.refresh(new_registration)
     return new_registration
 
+@app.post("/admin/registrations/import", response_model=registrations_io.ImportReport)
+async def import_registrations(request: Request, format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"), db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.admin_required)):
+    # The body is parsed while it streams in, see registrations_io.py. Columns: name, guests, user_id (optional)
+    fmt = format or registrations_io.format_from_content_type(request.headers.get("content-type", ""))
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Send text/csv or application/x-ndjson, or pass ?format=")
+    parse = registrations_io.csv_records if fmt == "csv" else registrations_io.ndjson_records
+    return await registrations_io.import_registrations(db, parse(request.stream()), current_user.id)
+
+@app.get("/admin/registrations/export")
+async def export_registrations(format: str = Query("csv", pattern="^(csv|ndjson)$"), current_user: auth_utils.Principal = Depends(auth_utils.admin_required)):
+    return StreamingResponse(
+        registrations_io.export_registrations(format),
+        media_type=registrations_io.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="registrations.{format}"'},
+    )
+
 @app.put("/registrations/{registration_id}", response_model=RegistrationInfo)
-async def update_registration(registration_id: int, registration: RegistrationData, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    db_registration = db.query(models.Registration).filter(models.Registration.id == registration_id).first()
+async def update_registration(registration_id: int, registration: RegistrationData, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    db_registration = await db.get(models.Registration, registration_id)
     if db_registration is None:
         raise HTTPException(status_code=404, detail="Registration not found")
     if db_registration.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this registration")
     for var, value in vars(registration).items():
         setattr(db_registration, var, value) if value else None
-    db.commit()
-    db.refresh(db_registration)
+    await db.commit()
+    await db.refresh(db_registration)
     return db_registration
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    # Prometheus text format, for a scraper configured with METRICS_TOKEN (see instrumentation.py)
+    if not instrumentation.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not instrumentation.metrics_authorized(request.headers.get("authorization", "")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(instrumentation.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def read_root():
     return {"message": "Hello World - Event Registration App"}
 
 @app.delete("/registrations/{registration_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_registration(registration_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth_utils.get_current_user)):
-    db_registration = db.query(models.Registration).filter(models.Registration.id == registration_id).first()
+async def delete_registration(registration_id: int, db: AsyncSession = Depends(database.get_db), current_user: auth_utils.Principal = Depends(auth_utils.get_current_principal)):
+    db_registration = await db.get(models.Registration, registration_id)
     if db_registration is None:
         raise HTTPException(status_code=404, detail="Registration not found")
     if db_registration.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this registration")
-    db.delete(db_registration)
-    db.commit()
+    await db.delete(db_registration)
+    await db.commit()
     return {"ok": True}
 
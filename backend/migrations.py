@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, column, inspect, select, table, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import auth_tokens, email_utils, models, stats
+
+# Base.metadata.create_all only creates missing tables, it never changes a table that already exists
+# in event_registrations.db. Schema changes to existing tables are therefore shipped as numbered
+# migrations below. Applied versions are recorded in the schema_migrations table and every migration
+# runs in its own transaction. Migrations must be idempotent: on a fresh database create_all has
+# already built the final schema and the migrations only get recorded.
+
+def _create_missing_indexes(conn: Connection):
+    """Create every index declared on the models that is missing from the database."""
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+# (table, unique constraint name, columns) added in the models after the tables were first created
+_TOGGLE_UNIQUE_CONSTRAINTS = [
+    ("likes", "uq_likes_user_image", ("user_id", "image_id")),
+    ("reactions", "uq_reactions_user_image_emoji", ("user_id", "image_id", "emoji")),
+    ("votes", "uq_votes_user_event_date", ("user_id", "event_date")),
+]
+
+def _toggle_unique_constraints(conn: Connection):
+    """Remove duplicate likes, reactions and votes, then enforce uniqueness with unique indexes."""
+    inspector = inspect(conn)
+    for table, name, columns in _TOGGLE_UNIQUE_CONSTRAINTS:
+        existing = {c["name"] for c in inspector.get_unique_constraints(table)}
+        existing |= {i["name"] for i in inspector.get_indexes(table)}
+        if name in existing:
+            continue
+        column_list = ", ".join(columns)
+        # Keep the oldest row of every duplicate group
+        conn.execute(text(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {column_list})"))
+        conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({column_list})"))
+    # The like and reaction counters may have counted the duplicates
+    stats.reconcile(conn)
+
+def _fill_vote_tallies(conn: Connection):
+    """Tally the votes cast before vote_tallies existed."""
+    stats.reconcile_vote_tallies(conn)
+
+# (code column, expiry column, auth_tokens purpose) that used to live on users
+_USER_TOKEN_COLUMNS = [
+    ("otp", "otp_expires_at", auth_tokens.OTP_PURPOSE),
+    ("reset_token", "reset_token_expires_at", auth_tokens.PASSWORD_RESET_PURPOSE),
+]
+
+def _move_codes_to_auth_tokens(conn: Connection):
+    """Copy pending OTPs and reset tokens into auth_tokens (hashed), then drop the columns from users."""
+    models.AuthToken.__table__.create(conn, checkfirst=True)
+    existing = {column["name"] for column in inspect(conn).get_columns("users")}
+    now = datetime.utcnow()
+    for code_column, expiry_column, purpose in _USER_TOKEN_COLUMNS:
+        if code_column not in existing:
+            continue
+        # The columns are gone from the model, describe them here so the expiry is read as a datetime
+        users = table("users", column("id"), column(code_column), column(expiry_column, DateTime))
+        code, expires_at = users.c[code_column], users.c[expiry_column]
+        rows = conn.execute(select(users.c.id, code, expires_at).where(code.isnot(None), expires_at >= now)).all()
+        pending = [
+            {"user_id": user_id, "purpose": purpose, "code_hash": auth_tokens.hash_code(value), "expires_at": expiry}
+            for user_id, value, expiry in rows
+        ]
+        if pending:
+            conn.execute(models.AuthToken.__table__.insert(), pending)
+        conn.execute(text(f"ALTER TABLE users DROP COLUMN {code_column}"))
+        conn.execute(text(f"ALTER TABLE users DROP COLUMN {expiry_column}"))
+
+def _strip_dead_letter_bodies(conn: Connection):
+    """Remove the bodies (and the one-time codes in them) of emails whose delivery was given up."""
+    conn.execute(
+        models.OutboundEmail.__table__.update()
+        .where(models.OutboundEmail.next_attempt_at.is_(None))
+        .values(body=email_utils.DEAD_LETTER_BODY)
+    )
+
+MIGRATIONS = [
+    (1, "unique constraints for like, reaction and vote toggles", _toggle_unique_constraints),
+    (2, "composite indexes for the hot query paths", _create_missing_indexes),
+    (3, "vote tallies", _fill_vote_tallies),
+    (4, "indexes for the admin listings", _create_missing_indexes),
+    (5, "move OTPs and reset tokens to auth_tokens", _move_codes_to_auth_tokens),
+    (6, "strip one-time codes from undeliverable emails", _strip_dead_letter_bodies),
+]
+
+def upgrade(engine: Engine):
+    """Apply every migration that has not been recorded in schema_migrations yet."""
+    models.SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(models.SchemaMigration.version)).scalars())
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                models.SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow())
+            )
+        print(f"Applied database migration {version}: {name}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel # Import BaseModel
 from .database import Base
@@ -12,22 +12,21 @@ class Registration(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     guests = Column(Integer, default=0)
-    user_id = Column(Integer, ForeignKey("users.id")) # Link to User
+    user_id = Column(Integer, ForeignKey("users.id"), index=True) # Link to User
 
     owner = relationship("User", back_populates="registrations") # Relationship to User
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_is_admin_id", "is_admin", "id"), # Admin listing filtered by role, in id order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=True) # Username can be null initially
     email = Column(String, unique=True, index=True) # New: Email field
     hashed_password = Column(String)
-    otp = Column(String, nullable=True) # New: One-Time Password
-    otp_expires_at = Column(DateTime, nullable=True) # New: OTP expiration time
     password_change_required = Column(Boolean, default=False) # New: Flag for forced password change
-    reset_token = Column(String, nullable=True) # New: Password reset token
-    reset_token_expires_at = Column(DateTime, nullable=True) # New: Password reset token expiration time
     is_admin = Column(Boolean, default=False)
 
     registrations = relationship("Registration", back_populates="owner") # Relationship to Registration
@@ -35,6 +34,19 @@ class User(Base):
     reactions = relationship("Reaction", back_populates="owner")
     votes = relationship("Vote", back_populates="owner")
     likes = relationship("Like", back_populates="owner")
+    auth_tokens = relationship("AuthToken", back_populates="owner")
+
+class AuthToken(Base):
+    __tablename__ = "auth_tokens"
+    __table_args__ = (UniqueConstraint("user_id", "purpose", name="uq_auth_tokens_user_purpose"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    purpose = Column(String, nullable=False) # "otp" or "password_reset", see auth_tokens.py
+    code_hash = Column(String, nullable=False) # HMAC of the code, never the code itself
+    expires_at = Column(DateTime, nullable=False, index=True) # Swept in batches once passed
+
+    owner = relationship("User", back_populates="auth_tokens")
 
 class Image(Base):
     __tablename__ = "images"
@@ -42,7 +54,7 @@ class Image(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     caption = Column(String)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     owner = relationship("User", back_populates="images")
     reactions = relationship("Reaction", back_populates="image")
@@ -50,6 +62,10 @@ class Image(Base):
 
 class Reaction(Base):
     __tablename__ = "reactions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "image_id", "emoji", name="uq_reactions_user_image_emoji"),
+        Index("ix_reactions_image_id_emoji", "image_id", "emoji"), # Per-image reaction counts
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     emoji = Column(String)
@@ -61,6 +77,10 @@ class Reaction(Base):
 
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        UniqueConstraint("user_id", "image_id", name="uq_likes_user_image"),
+        Index("ix_likes_image_id", "image_id"), # Per-image like counts and has_liked lookups
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -71,10 +91,63 @@ class Like(Base):
 
 class Vote(Base):
     __tablename__ = 'votes'
+    __table_args__ = (
+        UniqueConstraint("user_id", "event_date", name="uq_votes_user_event_date"),
+        Index("ix_votes_month_event_date", "month", "event_date"), # Votes of a month, grouped by date
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     event_date = Column(String, nullable=False)
     month = Column(String, nullable=False)
 
-    owner = relationship("User", back_populates="votes")
\ No newline at end of file
+    owner = relationship("User", back_populates="votes")
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True) # See migrations.py
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+
+class ImageVariant(Base):
+    __tablename__ = "image_variants"
+    __table_args__ = (UniqueConstraint("image_id", "width", "format", name="uq_image_variants_image_width_format"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=False)
+    width = Column(Integer, nullable=False)
+    format = Column(String, nullable=False) # "avif" or "webp", see variants.py
+    filename = Column(String, nullable=False) # Relative to the uploads directory
+
+class ImageStats(Base):
+    __tablename__ = "image_stats"
+
+    image_id = Column(Integer, ForeignKey("images.id"), primary_key=True)
+    like_count = Column(Integer, nullable=False, default=0) # Denormalized count of Like rows, see stats.py
+
+class ImageReactionCount(Base):
+    __tablename__ = "image_reaction_counts"
+
+    image_id = Column(Integer, ForeignKey("images.id"), primary_key=True)
+    emoji = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0) # Denormalized count of Reaction rows per emoji
+
+class VoteTally(Base):
+    __tablename__ = "vote_tallies"
+
+    month = Column(String, primary_key=True)
+    event_date = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0) # Denormalized count of Vote rows per date, see stats.py
+
+class OutboundEmail(Base):
+    __tablename__ = "outbound_emails"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True, index=True) # None once delivery has been given up, see email_utils.py
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
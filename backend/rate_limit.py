@@ -0,0 +1,213 @@
+import importlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException, status
+
+# Token bucket rate limiting for the endpoints that cost us SMTP quota or password hashing CPU. Each
+# policy names a route and the identities to limit it by: the client IP or the email in the request
+# body. Every identity gets its own bucket holding up to `burst` tokens, refilled at `per_second`. A
+# request takes one token from each of its buckets and is answered with 429 before the endpoint runs,
+# so a throttled request never reaches the database or the hashing pool.
+#
+# Logins are limited per account rather than per name: a username and an email reach the same
+# account, so the login takes from LOGIN_PER_ACCOUNT (see throttle) once it has looked the account up,
+# before the password is hashed.
+#
+# On event night the whole room shares the venue Wi-Fi's NAT address, so the per-IP limits only stop
+# floods and are set far above the per-identity ones, which do the real work. Every limit can be
+# changed through the environment as "count/seconds", e.g. RATE_LIMIT_LOGIN_PER_IP=600/60.
+#
+# Behind proxies the socket address is the proxy's. With RATE_LIMIT_TRUST_FORWARDED the client is the
+# address in X-Forwarded-For that the outermost of RATE_LIMIT_PROXY_HOPS trusted proxies appended,
+# counted from the right: the entries left of it come from the client and can be anything.
+#
+# Buckets live in process memory by default. Several workers or hosts can share them through a
+# backend with the same `take` method (Redis, ...): set RATE_LIMIT_BACKEND to "module:attribute".
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", 1)) # Trusted proxies that append to X-Forwarded-For
+RATE_LIMIT_MAX_BODY_BYTES = 64 * 1024 # Login and registration bodies are tiny, larger ones are refused
+
+@dataclass(frozen=True)
+class Limit:
+    burst: int
+    per_second: float
+
+    @classmethod
+    def per(cls, count: int, seconds: float) -> "Limit":
+        """`count` requests at once, refilled over `seconds`."""
+        return cls(burst=count, per_second=count / seconds)
+
+@dataclass(frozen=True)
+class Policy:
+    method: str
+    path: str
+    limits: Dict[str, Limit] # "ip" or "email" -> limit
+
+def limit_from_env(name: str, default: str) -> Limit:
+    """Read a "count/seconds" limit from the environment."""
+    value = os.getenv(name, default)
+    try:
+        count, seconds = value.split("/")
+        return Limit.per(int(count), float(seconds))
+    except ValueError:
+        raise ValueError(f"{name} must look like 'count/seconds', not {value!r}")
+
+POLICIES = [
+    # Every OTP request sends an email, and the OTP itself is only six digits
+    Policy("POST", "/register_simplified/", {
+        "ip": limit_from_env("RATE_LIMIT_OTP_PER_IP", "300/60"),
+        "email": limit_from_env("RATE_LIMIT_OTP_PER_EMAIL", "5/900"),
+    }),
+    # Every login attempt runs pbkdf2
+    Policy("POST", "/token", {
+        "ip": limit_from_env("RATE_LIMIT_LOGIN_PER_IP", "600/60"),
+    }),
+]
+LOGIN_PER_ACCOUNT = limit_from_env("RATE_LIMIT_LOGIN_PER_ACCOUNT", "10/300")
+
+class InMemoryBackend:
+    """Token buckets in a dict, the least recently used ones are dropped beyond max_keys."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict() # key -> (tokens, updated at)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take a token. Returns 0 when allowed, otherwise the seconds until a token is available."""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated_at) * limit.per_second)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / limit.per_second
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self):
+        self._buckets.clear()
+
+def load_backend():
+    if not RATE_LIMIT_BACKEND:
+        return InMemoryBackend()
+    module_name, _, attribute = RATE_LIMIT_BACKEND.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+buckets = load_backend()
+
+async def throttle(key: str, limit: Limit):
+    """Take a token from the bucket of `key` inside an endpoint, raises 429 when it is empty."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = await buckets.take(key, limit)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+def _client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED and RATE_LIMIT_PROXY_HOPS > 0:
+        forwarded = dict(scope["headers"]).get(b"x-forwarded-for")
+        addresses = [address.strip() for address in forwarded.decode("latin-1").split(",")] if forwarded else []
+        if len(addresses) >= RATE_LIMIT_PROXY_HOPS:
+            return addresses[-RATE_LIMIT_PROXY_HOPS]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _body_fields(headers: dict, body: bytes) -> dict:
+    """The fields of a JSON or form encoded body."""
+    content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip().lower()
+    try:
+        if content_type == "application/json":
+            data = json.loads(body or b"{}")
+            return data if isinstance(data, dict) else {}
+        if content_type == "application/x-www-form-urlencoded":
+            return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+    except ValueError:
+        pass # Malformed bodies are rejected by the endpoint itself
+    return {}
+
+class RateLimitMiddleware:
+    """Apply POLICIES before the request reaches the endpoint."""
+
+    def __init__(self, app, policies: List[Policy] = POLICIES, backend=None):
+        self.app = app
+        self.policies = {(policy.method, policy.path): policy for policy in policies}
+        self.backend = backend or buckets
+
+    async def __call__(self, scope, receive, send):
+        policy = self.policies.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if policy is None or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        body = b""
+        if set(policy.limits) - {"ip"}:
+            # Read the (small) body for the email, then hand it to the endpoint unchanged
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return # Client went away
+                body += message.get("body", b"")
+                more_body = message.get("more_body", False)
+                if len(body) > RATE_LIMIT_MAX_BODY_BYTES:
+                    await self._respond(send, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+                    return
+            receive = self._replay(body, receive)
+
+        fields = _body_fields(headers, body)
+        identities = {"ip": _client_ip(scope)}
+        if isinstance(fields.get("email"), str) and fields["email"].strip():
+            identities["email"] = fields["email"].strip().lower()
+
+        for kind, limit in policy.limits.items():
+            if kind not in identities:
+                continue
+            retry_after = await self.backend.take(f"{policy.path}:{kind}:{identities[kind]}", limit)
+            if retry_after:
+                await self._respond(
+                    send, status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests, please try again later.",
+                    [(b"retry-after", str(math.ceil(retry_after)).encode())],
+                )
+                return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay_receive
+
+    @staticmethod
+    async def _respond(send, status_code: int, detail: str, extra_headers: Optional[list] = None):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + (extra_headers or []),
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# Add the parent directory to sys.path to allow importing backend modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.database import SessionLocal, Base, engine
+from backend import models, stats
+
+def reconcile_stats():
+    """Recompute the denormalized like, reaction and vote counters from the raw rows."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        stats.reconcile(db)
+        db.commit()
+        images = db.query(models.ImageStats).count()
+        reaction_counters = db.query(models.ImageReactionCount).count()
+        vote_tallies = db.query(models.VoteTally).count()
+        print(f"Rebuilt like counters for {images} image(s), {reaction_counters} reaction counter(s) and {vote_tallies} vote tally(ies).")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    reconcile_stats()
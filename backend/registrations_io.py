@@ -0,0 +1,169 @@
+import codecs
+import csv
+import io
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+
+# Bulk registration import and export for large events. The import reads the request body as it
+# arrives, validates rows in batches of REGISTRATION_IMPORT_BATCH_SIZE and inserts each batch with a
+# single executemany in its own transaction. A bad row is reported with its row number and does not
+# stop the import. The export streams rows from a server side cursor. Both use constant memory
+# however long the guest list is.
+REGISTRATION_IMPORT_BATCH_SIZE = int(os.getenv("REGISTRATION_IMPORT_BATCH_SIZE", 500))
+REGISTRATION_IMPORT_MAX_ERRORS = 100 # Errors listed in the report, the rest are only counted
+REGISTRATION_EXPORT_BATCH_SIZE = 1000
+
+FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_COLUMNS = ("id", "name", "guests", "user_id")
+# Spreadsheets run a cell starting with one of these as a formula. Guests type their own names, so
+# such text cells are exported with a leading apostrophe.
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+class ImportRow(BaseModel):
+    name: str
+    guests: int = 0
+    user_id: Optional[int] = None # Defaults to the importing admin
+
+class ImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: List[Dict[str, object]] = [] # {"row": row number, "error": message}, at most REGISTRATION_IMPORT_MAX_ERRORS
+
+def format_from_content_type(content_type: str) -> Optional[str]:
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return "csv"
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines (keeping their line endings), whatever the chunk boundaries."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+async def csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (row number, dict or error message) for each CSV data row. The first row is the header."""
+    header = None
+    record = ""
+    row_number = 0
+    async for line in _lines(chunks):
+        record += line
+        if record.count('"') % 2:
+            continue # A quoted field continues on the next line
+        text, record = record, ""
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as e:
+            row_number += 1
+            yield row_number, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [column.strip().lower() for column in values]
+            continue
+        row_number += 1
+        # Empty cells fall back to the defaults of ImportRow
+        yield row_number, {column: value for column, value in zip(header, values) if value.strip() != ""}
+    if record.strip():
+        yield row_number + 1, "Invalid CSV: unterminated quoted field"
+
+async def ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (row number, dict or error message) for each line of an NDJSON body."""
+    row_number = 0
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            yield row_number, f"Invalid JSON: {e}"
+            continue
+        yield row_number, value if isinstance(value, dict) else "Expected a JSON object"
+
+async def _insert_batch(db: AsyncSession, batch: List[Tuple[int, dict]], report: ImportReport):
+    """Check the owners of a batch, insert the valid rows with one executemany and commit."""
+    user_ids = {row["user_id"] for _, row in batch}
+    existing = set((await db.execute(select(models.User.id).where(models.User.id.in_(user_ids)))).scalars())
+    valid = []
+    for row_number, row in batch:
+        if row["user_id"] in existing:
+            valid.append(row)
+        else:
+            _record_error(report, row_number, f"User {row['user_id']} does not exist")
+    if valid:
+        await db.execute(insert(models.Registration), valid)
+    await db.commit()
+    report.imported += len(valid)
+
+def _record_error(report: ImportReport, row_number: int, message: str):
+    report.failed += 1
+    if len(report.errors) < REGISTRATION_IMPORT_MAX_ERRORS:
+        report.errors.append({"row": row_number, "error": message})
+
+async def import_registrations(db: AsyncSession, records: AsyncIterator[Tuple[int, object]], default_user_id: int) -> ImportReport:
+    """Validate and insert parsed rows in batches. Rows committed before a failure stay imported."""
+    report = ImportReport()
+    batch: List[Tuple[int, dict]] = []
+    async for row_number, record in records:
+        if isinstance(record, str):
+            _record_error(report, row_number, record)
+            continue
+        try:
+            row = ImportRow.parse_obj(record)
+        except ValidationError as e:
+            _record_error(report, row_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        batch.append((row_number, {"name": row.name, "guests": row.guests, "user_id": row.user_id or default_user_id}))
+        if len(batch) >= REGISTRATION_IMPORT_BATCH_SIZE:
+            await _insert_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _insert_batch(db, batch, report)
+    return report
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+async def export_registrations(fmt: str) -> AsyncIterator[bytes]:
+    """Stream every registration as CSV or NDJSON, in id order."""
+    columns = [getattr(models.Registration, column) for column in EXPORT_COLUMNS]
+    # Own session: the stream outlives the request's dependencies
+    async with database.AsyncReadSessionLocal() as db:
+        result = await db.stream(
+            select(*columns).order_by(models.Registration.id).execution_options(yield_per=REGISTRATION_EXPORT_BATCH_SIZE)
+        )
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            async for rows in result.partitions():
+                writer.writerows([_csv_cell(value) for value in row] for row in rows)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        else:
+            async for rows in result.partitions():
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows).encode()
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from itertools import chain
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response, status
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import fast_json
+
+# Polling clients fetch the same lists over and over while nothing changes. Cached endpoints declare
+# the tables their response is built from. Every committed write bumps the version counter of the
+# tables it touched (tracked by the session events below, so no endpoint has to remember to do it),
+# and a cached body is served for as long as the versions it was built at are still current.
+#
+# The ETag is derived from the cache key and those versions, so If-None-Match is answered with 304
+# before anything is read or serialized, even after the body itself was evicted. The counters live in
+# this process: with several worker processes each one caches (and invalidates) on its own writes only.
+# Writes of other workers, or a read replica that was still lagging when an entry was built, are
+# therefore only picked up when the entry ages out: RESPONSE_CACHE_MAX_AGE_SECONDS bounds how stale a
+# response can be (0 disables the limit, for a single worker without replica).
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_MAX_AGE_SECONDS = float(os.getenv("RESPONSE_CACHE_MAX_AGE_SECONDS", 10))
+
+# Versions restart at zero with the process, the boot id keeps ETags from repeating across restarts
+_BOOT_ID = uuid.uuid4().hex
+
+class TableVersions:
+    """Per-table write counters."""
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+
+    def bump(self, tables: Iterable[str]):
+        for table in tables:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def snapshot(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+table_versions = TableVersions()
+
+# Collect the tables written in a session transaction and bump them once it commits
+
+def _written_tables(session: Session) -> set:
+    return session.info.setdefault("written_tables", set())
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed(session, flush_context):
+    _written_tables(session).update(obj.__table__.name for obj in chain(session.new, session.dirty, session.deleted))
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statements(orm_execute_state):
+    # INSERT / UPDATE / DELETE statements passed to session.execute, as the toggles and counters use
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _written_tables(orm_execute_state.session).add(orm_execute_state.statement.table.name)
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed(session):
+    table_versions.bump(session.info.pop("written_tables", ()))
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("written_tables", None)
+
+class ResponseCache:
+    """LRU of serialized JSON responses, valid while their tables are unchanged."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_age: float = RESPONSE_CACHE_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[tuple, Tuple[str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def respond(
+        self,
+        request: Request,
+        tables: Tuple[str, ...],
+        build: Callable[[], Awaitable[object]],
+        user_id: Optional[int] = None,
+    ) -> Response:
+        """Serve `build()` as JSON, from the cache when the tables are unchanged.
+
+        build returns plain lists and dicts shaped like the route's response_model, see fast_json.py.
+
+        Pass user_id when the response differs per user, it becomes part of the key.
+        """
+        key = (str(request.base_url), request.url.path, request.url.query, user_id) # Bodies embed absolute URLs
+        # Taken before building, a write that commits meanwhile makes this entry stale right away
+        versions = table_versions.snapshot(tables)
+        # Part of the ETag, so both the cached body and the 304s expire at the end of each period
+        period = int(time.time() // self.max_age) if self.max_age > 0 else 0
+        etag = '"' + hashlib.sha256(repr((_BOOT_ID, key, versions, period)).encode()).hexdigest()[:16] + '"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache" if user_id is not None else "no-cache"}
+
+        if etag in {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}:
+            self.hits += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == etag:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            body = cached[1]
+        else:
+            self.misses += 1
+            body = fast_json.dumps(await build())
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        self._entries.clear()
+
+response_cache = ResponseCache()
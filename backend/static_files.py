@@ -0,0 +1,104 @@
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# Cache policy for /static:
+# - Uploads are stored under their SHA-256 (see uploads.py), and their variants under that hash plus
+#   a width. Such URLs can never change content and are served with a one year immutable policy.
+# - Any other file can be requested as "<path>?v=<digest>" (see versioned_path). When the digest
+#   matches, the response is immutable as well.
+# - Everything else must be revalidated. Every response carries a strong ETag derived from the file
+#   content, so revalidation is answered with 304 instead of the file.
+# - If a compressed sibling ("<file>.br" or "<file>.gz") exists and the client accepts that encoding,
+#   it is served instead. Photos are already compressed and never looked up.
+# Ranges and zero-copy sending (the ASGI pathsend extension, when the server supports it) are
+# handled by Starlette's FileResponse.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+DIGEST_LENGTH = 16 # Hex characters of the SHA-256 used in ETags and ?v= versions
+
+_CONTENT_ADDRESSED = re.compile(r"^(?P<digest>[0-9a-f]{64})(-\d+)?\.[A-Za-z0-9]+$")
+_PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+def _file_digest(path: str) -> str:
+    name_match = _CONTENT_ADDRESSED.match(os.path.basename(path))
+    if name_match:
+        return name_match.group("digest")[:DIGEST_LENGTH]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with content-hash ETags, immutable versioned URLs and precompressed siblings."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # full path -> (mtime_ns, size, digest, {encoding: sibling path})
+        self._file_info = {}
+
+    def _describe(self, full_path: str, stat_result: os.stat_result):
+        """Digest and precompressed siblings of a file, cached until its mtime or size changes."""
+        cached = self._file_info.get(full_path)
+        if cached and cached[0] == stat_result.st_mtime_ns and cached[1] == stat_result.st_size:
+            return cached[2], cached[3]
+        siblings = {}
+        content_type = mimetypes.guess_type(full_path)[0] or ""
+        if not content_type.startswith(("image/", "video/")) or content_type == "image/svg+xml":
+            for encoding, suffix in _PRECOMPRESSED:
+                if os.path.isfile(full_path + suffix):
+                    siblings[encoding] = full_path + suffix
+        digest = _file_digest(full_path)
+        self._file_info[full_path] = (stat_result.st_mtime_ns, stat_result.st_size, digest, siblings)
+        return digest, siblings
+
+    def lookup_path(self, path: str):
+        # Runs in a worker thread, so hashing a file on first access does not block the event loop
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result and stat.S_ISREG(stat_result.st_mode):
+            self._describe(full_path, stat_result)
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        digest, siblings = self._describe(str(full_path), stat_result)
+
+        version = dict(item.split("=", 1) for item in scope.get("query_string", b"").decode().split("&") if "=" in item).get("v")
+        immutable = bool(_CONTENT_ADDRESSED.match(os.path.basename(full_path))) or version == digest
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            "etag": f'"{digest}"',
+        }
+
+        send_path, send_stat = full_path, stat_result
+        if siblings:
+            headers["vary"] = "Accept-Encoding"
+            accepted = {value.split(";")[0].strip() for value in request_headers.get("accept-encoding", "").split(",")}
+            for encoding, _ in _PRECOMPRESSED:
+                if encoding in accepted and encoding in siblings:
+                    send_path = siblings[encoding]
+                    send_stat = os.stat(send_path)
+                    headers["content-encoding"] = encoding
+                    headers["etag"] = f'"{digest}-{encoding}"' # Different bytes need a different strong ETag
+                    break
+
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+        response = FileResponse(send_path, status_code=status_code, headers=headers, media_type=media_type, stat_result=send_stat)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def versioned_path(self, path: str) -> str:
+        """Return "<path>?v=<digest>" for a file under the static directory. Blocking, call from a thread."""
+        full_path, stat_result = self.lookup_path(path)
+        if not stat_result:
+            return path
+        digest, _ = self._describe(full_path, stat_result)
+        return f"{path}?v={digest}"
@@ -0,0 +1,122 @@
+from sqlalchemy import func, select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import dialect_insert
+
+# The gallery reads like and reaction totals from image_stats / image_reaction_counts instead of
+# counting the raw Like / Reaction rows. The toggle endpoints adjust the counters inside the same
+# transaction as the row they insert or delete, and reconcile() rebuilds them from scratch.
+# Votes are tallied the same way in vote_tallies, one row per (month, event_date).
+#
+# Increments are a single INSERT ... ON CONFLICT DO UPDATE: the first like of an image creates its
+# counter row, and two concurrent first likes add up instead of colliding on the primary key.
+
+async def _increment(db: AsyncSession, model, key: dict, column: str, delta: int):
+    """Add `delta` (> 0) to a counter column, creating the row if needed."""
+    statement = dialect_insert(db, model).values(**key, **{column: delta})
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=list(key),
+        set_={column: getattr(model, column) + statement.excluded[column]},
+    ))
+
+async def adjust_like_count(db: AsyncSession, image_id: int, delta: int):
+    """Add `delta` to the like counter of an image. Must be committed together with the Like change."""
+    if delta > 0:
+        await _increment(db, models.ImageStats, {"image_id": image_id}, "like_count", delta)
+        return
+    await db.execute(
+        update(models.ImageStats)
+        .where(models.ImageStats.image_id == image_id)
+        .values(like_count=models.ImageStats.like_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+async def adjust_reaction_count(db: AsyncSession, image_id: int, emoji: str, delta: int):
+    """Add `delta` to the per-emoji reaction counter of an image, dropping counters that reach zero."""
+    counter = (models.ImageReactionCount.image_id == image_id, models.ImageReactionCount.emoji == emoji)
+    if delta > 0:
+        await _increment(db, models.ImageReactionCount, {"image_id": image_id, "emoji": emoji}, "count", delta)
+    elif delta < 0:
+        await db.execute(
+            update(models.ImageReactionCount)
+            .where(*counter)
+            .values(count=models.ImageReactionCount.count + delta)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            delete(models.ImageReactionCount)
+            .where(*counter, models.ImageReactionCount.count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+async def adjust_vote_tally(db: AsyncSession, month: str, event_date: str, delta: int):
+    """Add `delta` to the tally of an event date, dropping tallies that reach zero."""
+    tally = (models.VoteTally.month == month, models.VoteTally.event_date == event_date)
+    if delta > 0:
+        await _increment(db, models.VoteTally, {"month": month, "event_date": event_date}, "count", delta)
+    elif delta < 0:
+        await db.execute(
+            update(models.VoteTally)
+            .where(*tally)
+            .values(count=models.VoteTally.count + delta)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            delete(models.VoteTally)
+            .where(*tally, models.VoteTally.count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+async def like_count(db: AsyncSession, image_id: int) -> int:
+    return await db.scalar(select(models.ImageStats.like_count).where(models.ImageStats.image_id == image_id)) or 0
+
+async def reaction_count(db: AsyncSession, image_id: int, emoji: str) -> int:
+    return await db.scalar(
+        select(models.ImageReactionCount.count)
+        .where(models.ImageReactionCount.image_id == image_id, models.ImageReactionCount.emoji == emoji)
+    ) or 0
+
+async def vote_count(db: AsyncSession, month: str, event_date: str) -> int:
+    return await db.scalar(
+        select(models.VoteTally.count).where(models.VoteTally.month == month, models.VoteTally.event_date == event_date)
+    ) or 0
+
+async def delete_image_stats(db: AsyncSession, image_id: int):
+    """Remove the counters of a deleted image."""
+    await db.execute(delete(models.ImageStats).where(models.ImageStats.image_id == image_id))
+    await db.execute(delete(models.ImageReactionCount).where(models.ImageReactionCount.image_id == image_id))
+
+def reconcile_vote_tallies(db):
+    """Rebuild the vote tallies from the raw Vote rows. Works on a Session or a Connection, the caller commits."""
+    db.execute(delete(models.VoteTally))
+    db.execute(
+        insert(models.VoteTally).from_select(
+            ["month", "event_date", "count"],
+            select(models.Vote.month, models.Vote.event_date, func.count(models.Vote.id))
+            .group_by(models.Vote.month, models.Vote.event_date)
+        )
+    )
+
+def reconcile(db):
+    """Rebuild every counter from the raw Like, Reaction and Vote rows. Works on a Session or a Connection, the caller commits."""
+    reconcile_vote_tallies(db)
+    db.execute(delete(models.ImageReactionCount))
+    db.execute(delete(models.ImageStats))
+
+    db.execute(
+        insert(models.ImageStats).from_select(
+            ["image_id", "like_count"],
+            select(models.Like.image_id, func.count(models.Like.id))
+            .where(models.Like.image_id.in_(select(models.Image.id)))
+            .group_by(models.Like.image_id)
+        )
+    )
+    db.execute(
+        insert(models.ImageReactionCount).from_select(
+            ["image_id", "emoji", "count"],
+            select(models.Reaction.image_id, models.Reaction.emoji, func.count(models.Reaction.id))
+            .where(models.Reaction.image_id.in_(select(models.Image.id)))
+            .group_by(models.Reaction.image_id, models.Reaction.emoji)
+        )
+    )
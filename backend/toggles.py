@@ -0,0 +1,108 @@
+from typing import Optional
+
+from sqlalchemy import delete, select, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, stats
+from .database import dialect_insert
+
+# Likes, reactions and votes are on/off switches. Each toggle first tries to DELETE ... RETURNING the
+# existing row, and only when nothing was deleted it runs INSERT ... ON CONFLICT DO NOTHING RETURNING.
+# The unique constraints on the models make the insert idempotent, so two concurrent clicks can no
+# longer create duplicate rows, and no SELECT round trip is needed before the write.
+
+_insert = dialect_insert
+
+async def set_like(db: AsyncSession, user_id: int, image_id: int, liked: bool) -> bool:
+    """Make the like exist (or not) and adjust the counter. Returns whether a row was inserted or deleted."""
+    if not liked:
+        removed = (await db.execute(
+            delete(models.Like)
+            .where(models.Like.user_id == user_id, models.Like.image_id == image_id)
+            .returning(models.Like.id)
+        )).first()
+        if removed:
+            await stats.adjust_like_count(db, image_id, -1)
+        return removed is not None
+
+    # INSERT ... SELECT from images so a missing image inserts nothing
+    added = (await db.execute(
+        _insert(db, models.Like)
+        .from_select(["user_id", "image_id"], select(literal(user_id), models.Image.id).where(models.Image.id == image_id))
+        .on_conflict_do_nothing()
+        .returning(models.Like.id)
+    )).first()
+    if added:
+        await stats.adjust_like_count(db, image_id, 1)
+    return added is not None
+
+async def set_reaction(db: AsyncSession, user_id: int, image_id: int, emoji: str, reacted: bool) -> bool:
+    """Make the reaction exist (or not) and adjust the counter. Returns whether a row was inserted or deleted."""
+    if not reacted:
+        removed = (await db.execute(
+            delete(models.Reaction)
+            .where(models.Reaction.user_id == user_id, models.Reaction.image_id == image_id, models.Reaction.emoji == emoji)
+            .returning(models.Reaction.id)
+        )).first()
+        if removed:
+            await stats.adjust_reaction_count(db, image_id, emoji, -1)
+        return removed is not None
+
+    added = (await db.execute(
+        _insert(db, models.Reaction)
+        .from_select(
+            ["emoji", "user_id", "image_id"],
+            select(literal(emoji), literal(user_id), models.Image.id).where(models.Image.id == image_id)
+        )
+        .on_conflict_do_nothing()
+        .returning(models.Reaction.id)
+    )).first()
+    if added:
+        await stats.adjust_reaction_count(db, image_id, emoji, 1)
+    return added is not None
+
+async def toggle_like(db: AsyncSession, user_id: int, image_id: int) -> Optional[bool]:
+    """Like or unlike an image. Returns True when liked, False when unliked, None if the image does not exist."""
+    if await set_like(db, user_id, image_id, False):
+        return False
+    if await set_like(db, user_id, image_id, True):
+        return True
+    # Either the image is missing or a concurrent request liked it first
+    if await db.get(models.Image, image_id) is None:
+        return None
+    return True
+
+async def toggle_reaction(db: AsyncSession, user_id: int, image_id: int, emoji: str) -> Optional[bool]:
+    """Add or remove an emoji reaction. Returns True when added, False when removed, None if the image does not exist."""
+    if await set_reaction(db, user_id, image_id, emoji, False):
+        return False
+    if await set_reaction(db, user_id, image_id, emoji, True):
+        return True
+    if await db.get(models.Image, image_id) is None:
+        return None
+    return True
+
+async def toggle_vote(db: AsyncSession, user_id: int, event_date: str, month: str) -> Optional[models.Vote]:
+    """Vote or un-vote for an event date. Returns the vote when it was cast, None when it was removed."""
+    removed = (await db.execute(
+        delete(models.Vote)
+        .where(models.Vote.user_id == user_id, models.Vote.event_date == event_date)
+        .returning(models.Vote.month)
+    )).first()
+    if removed:
+        await stats.adjust_vote_tally(db, removed.month, event_date, -1)
+        return None
+
+    added = (await db.execute(
+        _insert(db, models.Vote)
+        .values(user_id=user_id, event_date=event_date, month=month)
+        .on_conflict_do_nothing()
+        .returning(models.Vote.id, models.Vote.user_id, models.Vote.event_date, models.Vote.month)
+    )).first()
+    if added:
+        await stats.adjust_vote_tally(db, month, event_date, 1)
+        return models.Vote(id=added.id, user_id=added.user_id, event_date=added.event_date, month=added.month)
+    # A concurrent request cast the same vote first
+    return (await db.execute(
+        select(models.Vote).where(models.Vote.user_id == user_id, models.Vote.event_date == event_date)
+    )).scalars().first()
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile, status
+
+# Uploaded photos are stored under the SHA-256 of their content (plus the original extension), so
+# the same photo uploaded twice is stored once and always served from the same URL. The file is
+# streamed in chunks to a temporary file in the uploads directory, hashed on the way, and renamed
+# into place atomically, so readers never see a partially written photo.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def _too_large():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Upload exceeds the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit.",
+    )
+
+class UploadSizeLimitMiddleware:
+    """Reject upload request bodies over the limit while they are received, before they are spooled to disk."""
+
+    def __init__(self, app, path: str, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.path = path
+        # Leave room for the multipart boundaries and the caption field
+        self.max_body_bytes = max_bytes + 64 * 1024
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # Raised inside the form parser, FastAPI passes HTTPExceptions through as the response
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = f'{{"detail":"{_too_large().detail}"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+async def store_upload(file: UploadFile, uploads_dir: str) -> str:
+    """Stream an uploaded file into uploads_dir under its content hash. Returns the stored filename."""
+    extension = os.path.splitext(os.path.basename(file.filename or ""))[1].lower()
+    fd, temp_path = tempfile.mkstemp(dir=uploads_dir, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise _too_large()
+                digest.update(chunk)
+                await asyncio.to_thread(buffer.write, chunk)
+            await asyncio.to_thread(os.fsync, buffer.fileno())
+
+        filename = f"{digest.hexdigest()}{extension}"
+        final_path = os.path.join(uploads_dir, filename)
+        if os.path.exists(final_path):
+            # Same content is already stored, keep the existing file (and its cache validators)
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, final_path)
+        return filename
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image as PILImage, ImageOps
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+
+# Gallery grids and phones do not need the full size originals. After an upload, a background pool
+# renders each photo at a few widths in modern formats into uploads/variants and records them in the
+# image_variants table. ImageInfo.srcset exposes them per format so the browser can pick the
+# smallest file that fits. The original stays the fallback.
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("VARIANT_WIDTHS", "320,640,1280").split(","))
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", 1))
+VARIANTS_SUBDIR = "variants"
+
+# Pillow option sets per output format, AVIF is only used when this Pillow build can write it
+VARIANT_FORMATS = {
+    "avif": {"quality": 50},
+    "webp": {"quality": 75, "method": 4},
+}
+
+def available_formats() -> List[str]:
+    extensions = PILImage.registered_extensions()
+    return [fmt for fmt in VARIANT_FORMATS if f".{fmt}" in extensions and fmt.upper() in PILImage.SAVE]
+
+def generate_variants(source_path: str, variants_dir: str, widths=VARIANT_WIDTHS, formats=None) -> List[tuple]:
+    """Render the resized variants of one photo. Returns (width, format, filename) for each file written.
+
+    Runs in a worker process. Widths larger than the original are skipped, nothing is upscaled.
+    """
+    formats = formats or available_formats()
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    os.makedirs(variants_dir, exist_ok=True)
+    written = []
+    with PILImage.open(source_path) as original:
+        original = ImageOps.exif_transpose(original) # Phone photos carry their rotation in EXIF
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGB")
+        for width in sorted(widths):
+            if width >= original.width:
+                continue
+            height = round(original.height * width / original.width)
+            resized = original.resize((width, height), PILImage.LANCZOS)
+            for fmt in formats:
+                filename = f"{stem}-{width}.{fmt}"
+                target = os.path.join(variants_dir, filename)
+                if not os.path.exists(target):
+                    temp_target = f"{target}.part"
+                    resized.save(temp_target, format=fmt.upper(), **VARIANT_FORMATS[fmt])
+                    os.replace(temp_target, target)
+                written.append((width, fmt, filename))
+    return written
+
+async def record_variants(db: AsyncSession, image_id: int, written: List[tuple]):
+    """Replace the variant rows of an image."""
+    await db.execute(delete(models.ImageVariant).where(models.ImageVariant.image_id == image_id))
+    db.add_all([models.ImageVariant(image_id=image_id, width=width, format=fmt, filename=f"{VARIANTS_SUBDIR}/{filename}")
+                for width, fmt, filename in written])
+
+async def srcsets_for(db: AsyncSession, image_ids: List[int], url_for) -> Dict[int, Dict[str, str]]:
+    """Build {image id: {format: srcset}} for a page of images. url_for maps a static path to a URL."""
+    srcsets: Dict[int, Dict[str, list]] = {}
+    if not image_ids:
+        return {}
+    rows = await db.execute(
+        select(models.ImageVariant.image_id, models.ImageVariant.format, models.ImageVariant.width, models.ImageVariant.filename)
+        .where(models.ImageVariant.image_id.in_(image_ids))
+        .order_by(models.ImageVariant.image_id, models.ImageVariant.format, models.ImageVariant.width)
+    )
+    for image_id, fmt, width, filename in rows:
+        srcsets.setdefault(image_id, {}).setdefault(fmt, []).append(f"{url_for(filename)} {width}w")
+    return {image_id: {fmt: ", ".join(entries) for fmt, entries in formats.items()} for image_id, formats in srcsets.items()}
+
+def delete_variant_files(uploads_dir: str, source_filename: str):
+    """Remove the variant files rendered from a source file."""
+    stem = os.path.splitext(source_filename)[0]
+    variants_dir = os.path.join(uploads_dir, VARIANTS_SUBDIR)
+    for width in VARIANT_WIDTHS:
+        for fmt in VARIANT_FORMATS:
+            path = os.path.join(variants_dir, f"{stem}-{width}.{fmt}")
+            if os.path.exists(path):
+                os.remove(path)
+
+class VariantPipeline:
+    """Renders variants for new uploads in a process pool, off the request path."""
+
+    def __init__(self, workers: int = VARIANT_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = set()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned, not forked: the server process is multithreaded by now (see auth_utils.PasswordHashPool)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def schedule(self, image_id: int, uploads_dir: str, filename: str):
+        """Start rendering the variants of an uploaded image, returns immediately."""
+        task = asyncio.create_task(self._render(image_id, uploads_dir, filename))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _render(self, image_id: int, uploads_dir: str, filename: str):
+        try:
+            written = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), generate_variants,
+                os.path.join(uploads_dir, filename), os.path.join(uploads_dir, VARIANTS_SUBDIR)
+            )
+            async with database.AsyncSessionLocal() as db:
+                if await db.get(models.Image, image_id) is None:
+                    return # Deleted while rendering
+                await record_variants(db, image_id, written)
+                await db.commit()
+        except Exception as e:
+            print(f"Failed to render variants of image {image_id} ({filename}): {e}")
+
+    async def drain(self):
+        """Wait for the variants that are currently rendering."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+pipeline = VariantPipeline()
@@ -0,0 +1,256 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import exists, select
+
+from . import database, events, models, stats, toggles
+from .response_cache import table_versions
+
+# Optional write coalescing for likes and reactions. During a live event every click is its own tiny
+# transaction, and on SQLite every commit is an fsync. With WRITE_BUFFER_ENABLED, a toggle is decided
+# against an in-memory map of pending states and acknowledged right away. A background task writes
+# all pending states in one transaction every WRITE_BUFFER_FLUSH_MS, or as soon as
+# WRITE_BUFFER_MAX_OPS states are pending. A like that is toggled twice before the flush is never
+# written at all.
+#
+# WRITE_BUFFER_DURABILITY picks when the request returns:
+# - "group": once the transaction holding its change has committed. Nothing acknowledged is lost,
+#   concurrent requests share one commit.
+# - "buffered": immediately. A crash loses the changes of the last flush interval.
+#
+# Reads stay consistent with the buffer: the gallery overlays pending states on the committed counts
+# (see overlay), every buffered toggle invalidates the cached gallery pages, and the live update
+# events carry the committed count plus the pending changes. They are published once a flush has
+# committed, so a failed flush never announces changes that were not written.
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "false").lower() in ("1", "true", "yes")
+WRITE_BUFFER_FLUSH_MS = float(os.getenv("WRITE_BUFFER_FLUSH_MS", 50))
+WRITE_BUFFER_MAX_OPS = int(os.getenv("WRITE_BUFFER_MAX_OPS", 500))
+WRITE_BUFFER_DURABILITY = os.getenv("WRITE_BUFFER_DURABILITY", "group")
+
+# ("like", user_id, image_id, "") or ("reaction", user_id, image_id, emoji)
+Key = Tuple[str, int, int, str]
+
+class WriteBuffer:
+    """Pending like and reaction states, flushed to the database in grouped transactions."""
+
+    def __init__(self, enabled: bool = WRITE_BUFFER_ENABLED, flush_ms: float = WRITE_BUFFER_FLUSH_MS,
+                 max_ops: int = WRITE_BUFFER_MAX_OPS, durability: str = WRITE_BUFFER_DURABILITY):
+        if durability not in ("group", "buffered"):
+            raise ValueError(f"WRITE_BUFFER_DURABILITY must be 'group' or 'buffered', not {durability!r}")
+        self.enabled = enabled
+        self.flush_seconds = flush_ms / 1000
+        self.max_ops = max_ops
+        self.durability = durability
+        # key -> (desired state, committed state it replaces)
+        self.pending: Dict[Key, Tuple[bool, bool]] = {}
+        self.inflight: Dict[Key, Tuple[bool, bool]] = {} # Being written by the current flush
+        self._generation = 0 # Incremented by every flush, detects database reads that raced one
+        self._waiters: List[asyncio.Future] = []
+        self._has_pending: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock() # One flush at a time, stop() may race the flusher's last one
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._has_pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still pending."""
+        if self._task is None:
+            return
+        # Not cancelled: a cancellation could land in the middle of a flush's commit
+        self._stopping = True
+        self._has_pending.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            await self._has_pending.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep flushing, a dead flusher would leave every "group" request waiting forever
+                print(f"Write buffer flush error: {e}")
+
+    def _current(self, key: Key) -> Optional[bool]:
+        if key in self.pending:
+            return self.pending[key][0]
+        if key in self.inflight:
+            return self.inflight[key][0]
+        return None
+
+    async def _committed_state(self, key: Key) -> Optional[bool]:
+        """Read whether the like or reaction exists. None if the image does not exist."""
+        kind, user_id, image_id, emoji = key
+        if kind == "like":
+            row_exists = exists().where(models.Like.user_id == user_id, models.Like.image_id == image_id)
+        else:
+            row_exists = exists().where(models.Reaction.user_id == user_id, models.Reaction.image_id == image_id, models.Reaction.emoji == emoji)
+        async with database.AsyncSessionLocal() as db:
+            row = (await db.execute(select(exists().where(models.Image.id == image_id), row_exists))).one()
+        return bool(row[1]) if row[0] else None
+
+    async def _toggle(self, key: Key) -> Optional[bool]:
+        current = self._current(key)
+        base = None
+        while current is None:
+            generation = self._generation
+            committed = await self._committed_state(key)
+            if committed is None:
+                return None
+            current = self._current(key) # A concurrent toggle of the same key may have won the race
+            if current is None and generation == self._generation:
+                current = committed
+        base = self.pending[key][1] if key in self.pending else current
+
+        desired = not current
+        if desired == base:
+            self.pending.pop(key, None) # Toggled back before the flush, nothing to write
+        else:
+            self.pending[key] = (desired, base)
+        table_versions.bump(("likes", "image_stats") if key[0] == "like" else ("reactions", "image_reaction_counts"))
+
+        self._has_pending.set()
+        if len(self.pending) >= self.max_ops:
+            self._full.set()
+        if self._task is None:
+            await self.flush() # The flusher has stopped (shutting down), write through
+        elif self.durability == "group":
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        return desired
+
+    async def toggle_like(self, user_id: int, image_id: int) -> Optional[bool]:
+        """Like or unlike through the buffer. Same results as toggles.toggle_like."""
+        return await self._toggle(("like", user_id, image_id, ""))
+
+    async def toggle_reaction(self, user_id: int, image_id: int, emoji: str) -> Optional[bool]:
+        """Add or remove a reaction through the buffer. Same results as toggles.toggle_reaction."""
+        return await self._toggle(("reaction", user_id, image_id, emoji))
+
+    async def flush(self):
+        """Write every pending state in one transaction, then release the waiting requests."""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self._has_pending is not None:
+            self._has_pending.clear()
+            self._full.clear()
+        waiters, self._waiters = self._waiters, []
+        if not self.pending:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None) # Their toggles cancelled out
+            return
+        self.inflight, self.pending = self.pending, {}
+        try:
+            async with database.AsyncSessionLocal() as db:
+                for (kind, user_id, image_id, emoji), (desired, _) in self.inflight.items():
+                    if kind == "like":
+                        await toggles.set_like(db, user_id, image_id, desired)
+                    else:
+                        await toggles.set_reaction(db, user_id, image_id, emoji, desired)
+                await db.commit()
+        except asyncio.CancelledError:
+            # Whether or not the commit went through, writing the same states again is harmless
+            # (set_like and set_reaction only change what differs). The next flush releases the waiters.
+            self._requeue_failed(keep=True, maybe_committed=True)
+            self._waiters = waiters + self._waiters
+            raise
+        except Exception as e:
+            print(f"Write buffer flush of {len(self.inflight)} change(s) failed: {e}")
+            self._requeue_failed(keep=self.durability == "buffered")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not save the change, please try again."
+                    ))
+            return
+        flushed, self.inflight = self.inflight, {}
+        self._generation += 1
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        try:
+            await self._publish(flushed)
+        except Exception as e:
+            # The changes are committed, only their live updates are lost (clients resync on reconnect)
+            print(f"Write buffer could not publish {len(flushed)} change(s): {e}")
+
+    def _requeue_failed(self, keep: bool, maybe_committed: bool = False):
+        """Put the changes of a flush that did not commit back in front of the pending ones.
+
+        keep=False drops the changes whose requests were told about the failure ("group" mode).
+        maybe_committed keeps toggles that returned to the old state: they have to be written too
+        in case the interrupted commit did go through.
+        """
+        failed, self.inflight = self.inflight, {}
+        self._generation += 1
+        for key, (desired, base) in failed.items():
+            if key in self.pending:
+                # Toggled again meanwhile: the committed state is still the one before the failed flush
+                self.pending[key] = (self.pending[key][0], base)
+                if self.pending[key][0] == base and not maybe_committed:
+                    del self.pending[key]
+            elif keep:
+                self.pending[key] = (desired, base) # Retried with the next flush
+        if self.pending and self._has_pending is not None:
+            self._has_pending.set()
+
+    async def _publish(self, flushed: Dict[Key, Tuple[bool, bool]]):
+        liked_images = sorted({image_id for kind, _, image_id, _ in flushed if kind == "like"})
+        reacted = sorted({(image_id, emoji) for kind, _, image_id, emoji in flushed if kind == "reaction"})
+        like_delta, _, reaction_delta = self.overlay(None, liked_images + [image_id for image_id, _ in reacted])
+        async with database.AsyncSessionLocal() as db:
+            for image_id in liked_images:
+                count = await stats.like_count(db, image_id) + like_delta.get(image_id, 0)
+                events.publish("like", image_id=image_id, like_count=count)
+            for image_id, emoji in reacted:
+                count = await stats.reaction_count(db, image_id, emoji) + reaction_delta.get(image_id, {}).get(emoji, 0)
+                events.publish("reaction", image_id=image_id, emoji=emoji, count=count)
+
+    def overlay(self, user_id: Optional[int], image_ids: List[int]):
+        """Changes not committed yet, for a page of images.
+
+        Returns (like count delta per image, like state of user_id per image, reaction count delta per image and emoji).
+        """
+        like_delta: Dict[int, int] = {}
+        liked: Dict[int, bool] = {}
+        reaction_delta: Dict[int, Dict[str, int]] = {}
+        if not (self.pending or self.inflight):
+            return like_delta, liked, reaction_delta
+        wanted = set(image_ids)
+        # The inflight base is the committed state, a pending entry for the same key starts where it ends
+        for changes in (self.inflight, self.pending):
+            for (kind, key_user_id, image_id, emoji), (desired, base) in changes.items():
+                if image_id not in wanted:
+                    continue
+                delta = int(desired) - int(base)
+                if kind == "like":
+                    like_delta[image_id] = like_delta.get(image_id, 0) + delta
+                    if key_user_id == user_id:
+                        liked[image_id] = desired
+                else:
+                    counts = reaction_delta.setdefault(image_id, {})
+                    counts[emoji] = counts.get(emoji, 0) + delta
+        return like_delta, liked, reaction_delta
+
+buffer = WriteBuffer()
@@ -100,9 +100,12 @@ function App() {
         // Select and set a new random background if not logged in
         if (!authToken && data.length > 0) {
           const randomIndex = Math.floor(Math.random() * data.length);
-          const newSelectedBackground = `${API_BASE_URL}/static/BackgroundLogin/${data[randomIndex]}`;
+          const selected = data[randomIndex];
+          const newSelectedBackground = `${API_BASE_URL}/static/${selected.path}`;
           setCurrentBackground(newSelectedBackground);
           localStorage.setItem('lastBackgroundUrl', newSelectedBackground);
+          // Show the dominant colour until the photo has loaded
+          document.body.style.backgroundColor = selected.dominant_color || '';
           document.body.style.backgroundImage = `url(${newSelectedBackground})`;
           document.body.style.backgroundSize = 'cover';
           document.body.style.backgroundPosition = 'center';
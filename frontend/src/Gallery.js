@@ -1,8 +1,9 @@
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useAuth } from './App';
 import Modal from './Modal';
 import Upload from './Upload'; // Import the Upload component
+import { subscribeToEvents } from './liveEvents';
 
 function Gallery() {
   const [images, setImages] = useState([]);
@@ -11,19 +12,59 @@ function Gallery() {
   const [currentIndex, setCurrentIndex] = useState(0);
 
   const API_BASE_URL = 'http://localhost:8000';
+  // Rendered width of a grid cell, lets the browser pick the smallest variant from the srcset
+  const GRID_IMAGE_SIZES = '(max-width: 600px) 100vw, 320px';
+
+  const [nextCursor, setNextCursor] = useState(null);
+  // Number of loaded images, read by the long-lived event listeners (which would otherwise see the first render's list)
+  const loadedCount = useRef(0);
+  loadedCount.current = images.length;
+
+  const fetchPage = async (after) => {
+    const params = after != null ? `?after=${after}` : '';
+    const response = await fetch(`${API_BASE_URL}/images/${params}`, {
+      headers: {
+        'Authorization': `Bearer ${authToken}`,
+      },
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json();
+  };
 
   const fetchImages = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/images/`, {
-        headers: {
-          'Authorization': `Bearer ${authToken}`,
-        },
-      });
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-      const data = await response.json();
-      setImages(data);
+      const data = await fetchPage(null);
+      setImages(data.items);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching images:', error);
+    }
+  };
+
+  const loadMoreImages = async () => {
+    try {
+      const data = await fetchPage(nextCursor);
+      setImages(prevImages => [...prevImages, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching images:', error);
+    }
+  };
+
+  // Re-read every page that is currently displayed, so counts stay fresh without losing scroll position
+  const refreshLoadedImages = async () => {
+    try {
+      let loaded = [];
+      let cursor = null;
+      do {
+        const data = await fetchPage(cursor);
+        loaded = [...loaded, ...data.items];
+        cursor = data.next_cursor;
+      } while (cursor != null && loaded.length < loadedCount.current);
+      setImages(loaded);
+      setNextCursor(cursor);
     } catch (error) {
       console.error('Error fetching images:', error);
     }
@@ -35,6 +76,36 @@ function Gallery() {
     }
   }, [authToken]);
 
+  // Live like and reaction totals pushed by the server, applied to the loaded images in place
+  useEffect(() => {
+    if (!authToken) {
+      return undefined;
+    }
+    return subscribeToEvents(API_BASE_URL, authToken, {
+      like: (event) => {
+        const { image_id, like_count } = JSON.parse(event.data);
+        setImages(prevImages => prevImages.map(image => (
+          image.id === image_id ? { ...image, like_count } : image
+        )));
+      },
+      reaction: (event) => {
+        const { image_id, emoji, count } = JSON.parse(event.data);
+        setImages(prevImages => prevImages.map(image => {
+          if (image.id !== image_id) {
+            return image;
+          }
+          const reaction_counts = { ...image.reaction_counts, [emoji]: count };
+          if (count === 0) {
+            delete reaction_counts[emoji];
+          }
+          return { ...image, reaction_counts };
+        }));
+      },
+      // Sent when this client fell behind and missed deltas
+      resync: () => refreshLoadedImages(),
+    }, () => refreshLoadedImages());
+  }, [authToken]);
+
   const handleLike = async (id) => {
     try {
       const response = await fetch(`${API_BASE_URL}/images/${id}/like`, {
@@ -46,7 +117,10 @@ function Gallery() {
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      fetchImages(); // Refetch images to update likes
+      // The new like total arrives as a 'like' event (usually before this response), only flip our own state
+      setImages(prevImages => prevImages.map(image => (
+        image.id === id ? { ...image, has_liked: !image.has_liked } : image
+      )));
     } catch (error) {
       console.error('Error liking image:', error);
     }
@@ -65,7 +139,7 @@ function Gallery() {
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      fetchImages(); // Refetch images to update reactions
+      // The new reaction total arrives as a 'reaction' event, no refetch needed
     } catch (error) {
       console.error('Error reacting to image:', error);
     }
@@ -99,18 +173,18 @@ function Gallery() {
       <div className="image-grid">
         {images.map((image, index) => (
           <div key={image.id} className="image-card">
-            <img src={`${API_BASE_URL}/static/${image.filename}`} alt={image.caption} onClick={() => openModal(index)} />
+            <picture onClick={() => openModal(index)}>
+              {['avif', 'webp'].filter(format => image.srcset[format]).map(format => (
+                <source key={format} type={`image/${format}`} srcSet={image.srcset[format]} sizes={GRID_IMAGE_SIZES} />
+              ))}
+              <img src={`${API_BASE_URL}/static/${image.filename}`} alt={image.caption} loading="lazy" />
+            </picture>
             <div className="image-info">
               <div className="image-caption">{image.caption}</div>
               <div className="image-actions">
-                <button onClick={() => handleLike(image.id)}>{image.has_liked ? '❤️' : '🤍'} {image.likes.length}</button>
+                <button onClick={() => handleLike(image.id)}>{image.has_liked ? '❤️' : '🤍'} {image.like_count}</button>
                 <div className="reactions">
-                  {Object.entries(
-                    image.reactions.reduce((acc, reaction) => {
-                      acc[reaction.emoji] = (acc[reaction.emoji] || 0) + 1;
-                      return acc;
-                    }, {})
-                  ).map(([emoji, count]) => (
+                  {Object.entries(image.reaction_counts).map(([emoji, count]) => (
                     <span key={emoji}>{emoji} {count}</span>
                   ))}
                 </div>
@@ -124,6 +198,7 @@ function Gallery() {
           </div>
         ))}
       </div>
+      {nextCursor != null && <button className="load-more-button" onClick={loadMoreImages}>Load more</button>}
       <Modal filename={selectedImage?.filename} caption={selectedImage?.caption} onClose={closeModal} onNext={showNextImage} onPrev={showPrevImage} />
     </div>
   );
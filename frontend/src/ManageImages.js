@@ -4,13 +4,16 @@ import { useAuth } from './App';
 
 function ManageImages() {
   const [images, setImages] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const { authToken } = useAuth();
 
   const API_BASE_URL = 'http://localhost:8000';
 
-  const fetchImages = async () => {
+  // Without a cursor the first page replaces the list, with one the next page is appended
+  const fetchImages = async (after = null) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/images/`, {
+      const params = after != null ? `?after=${after}` : '';
+      const response = await fetch(`${API_BASE_URL}/images/${params}`, {
         headers: {
           'Authorization': `Bearer ${authToken}`,
         },
@@ -19,7 +22,8 @@ function ManageImages() {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
-      setImages(data);
+      setImages(prevImages => (after != null ? [...prevImages, ...data.items] : data.items));
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Error fetching images:', error);
     }
@@ -42,7 +46,8 @@ function ManageImages() {
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      fetchImages();
+      // Remove it in place, refetching would drop the pages loaded after the first one
+      setImages(prevImages => prevImages.filter(image => image.id !== id));
     } catch (error) {
       console.error('Error deleting image:', error);
     }
@@ -73,6 +78,9 @@ function ManageImages() {
           ))}
         </tbody>
       </table>
+      {nextCursor != null && (
+        <button onClick={() => fetchImages(nextCursor)}>Load more</button>
+      )}
     </div>
   );
 }
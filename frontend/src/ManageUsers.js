@@ -5,6 +5,10 @@ import { jwtDecode } from 'jwt-decode';
 
 function ManageUsers() {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [total, setTotal] = useState({ count: 0, exact: true });
+  const [search, setSearch] = useState('');
+  const [adminFilter, setAdminFilter] = useState(''); // '', 'true' or 'false'
   const { authToken } = useAuth();
   const [currentUserId, setCurrentUserId] = useState(null);
 
@@ -21,9 +25,14 @@ function ManageUsers() {
     }
   }, [authToken]);
 
-  const fetchUsers = async () => {
+  // One page of users matching the current search and filter, `after` is the cursor of the previous page
+  const fetchUsers = async (after = null) => {
+    const params = new URLSearchParams();
+    if (search) params.set('q', search);
+    if (adminFilter) params.set('is_admin', adminFilter);
+    if (after != null) params.set('after', after);
     try {
-      const response = await fetch(`${API_BASE_URL}/users/`, {
+      const response = await fetch(`${API_BASE_URL}/users/?${params}`, {
         headers: {
           'Authorization': `Bearer ${authToken}`,
         },
@@ -32,7 +41,9 @@ function ManageUsers() {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
-      setUsers(data);
+      setUsers(prevUsers => (after != null ? [...prevUsers, ...data.items] : data.items));
+      setNextCursor(data.next_cursor);
+      setTotal({ count: data.total_estimate, exact: data.total_exact });
     } catch (error) {
       console.error('Error fetching users:', error);
     }
@@ -40,9 +51,12 @@ function ManageUsers() {
 
   useEffect(() => {
     if (authToken) {
-      fetchUsers();
+      // Debounced so typing a prefix does not send a request per keystroke
+      const timer = setTimeout(() => fetchUsers(), 250);
+      return () => clearTimeout(timer);
     }
-  }, [authToken]);
+    return undefined;
+  }, [authToken, search, adminFilter]);
 
   const handleUpdateUser = async (id, isAdmin) => {
     try {
@@ -81,6 +95,20 @@ function ManageUsers() {
   return (
     <div className="manage-users-container">
       <h2>Manage Users</h2>
+      <div className="admin-filters">
+        <input
+          type="text"
+          placeholder="Username or email starts with..."
+          value={search}
+          onChange={(e) => setSearch(e.target.value)}
+        />
+        <select value={adminFilter} onChange={(e) => setAdminFilter(e.target.value)}>
+          <option value="">All users</option>
+          <option value="true">Admins</option>
+          <option value="false">Members</option>
+        </select>
+        <span>{total.count}{total.exact ? '' : '+'} users</span>
+      </div>
       <table>
         <thead>
           <tr>
@@ -115,6 +143,9 @@ function ManageUsers() {
           ))}
         </tbody>
       </table>
+      {nextCursor != null && (
+        <button onClick={() => fetchUsers(nextCursor)}>Load more</button>
+      )}
     </div>
   );
 }
@@ -4,13 +4,22 @@ import { useAuth } from './App';
 
 function ManageVotes() {
   const [votes, setVotes] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [total, setTotal] = useState({ count: 0, exact: true });
+  const [search, setSearch] = useState('');
+  const [month, setMonth] = useState('');
   const { authToken } = useAuth();
 
   const API_BASE_URL = 'http://localhost:8000';
 
-  const fetchAllVotes = async () => {
+  // One page of votes matching the current filters, `after` is the cursor of the previous page
+  const fetchAllVotes = async (after = null) => {
+    const params = new URLSearchParams();
+    if (search) params.set('q', search);
+    if (month) params.set('month', month);
+    if (after != null) params.set('after', after);
     try {
-      const response = await fetch(`${API_BASE_URL}/admin/votes`, {
+      const response = await fetch(`${API_BASE_URL}/admin/votes?${params}`, {
         headers: {
           'Authorization': `Bearer ${authToken}`,
         },
@@ -19,7 +28,9 @@ function ManageVotes() {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
-      setVotes(data);
+      setVotes(prevVotes => (after != null ? [...prevVotes, ...data.items] : data.items));
+      setNextCursor(data.next_cursor);
+      setTotal({ count: data.total_estimate, exact: data.total_exact });
     } catch (error) {
       console.error('Error fetching votes:', error);
     }
@@ -27,13 +38,31 @@ function ManageVotes() {
 
   useEffect(() => {
     if (authToken) {
-      fetchAllVotes();
+      // Debounced so typing a prefix does not send a request per keystroke
+      const timer = setTimeout(() => fetchAllVotes(), 250);
+      return () => clearTimeout(timer);
     }
-  }, [authToken]);
+    return undefined;
+  }, [authToken, search, month]);
 
   return (
     <div className="manage-votes-container">
       <h2>Manage Votes</h2>
+      <div className="admin-filters">
+        <input
+          type="text"
+          placeholder="Username starts with..."
+          value={search}
+          onChange={(e) => setSearch(e.target.value)}
+        />
+        <select value={month} onChange={(e) => setMonth(e.target.value)}>
+          <option value="">All months</option>
+          {['September', 'October', 'November', 'December'].map(name => (
+            <option key={name} value={name}>{name}</option>
+          ))}
+        </select>
+        <span>{total.count}{total.exact ? '' : '+'} votes</span>
+      </div>
       <table>
         <thead>
           <tr>
@@ -56,6 +85,9 @@ function ManageVotes() {
           ))}
         </tbody>
       </table>
+      {nextCursor != null && (
+        <button onClick={() => fetchAllVotes(nextCursor)}>Load more</button>
+      )}
     </div>
   );
 }
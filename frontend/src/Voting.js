@@ -2,12 +2,13 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from './App';
 import { useNavigate } from 'react-router-dom';
+import { subscribeToEvents } from './liveEvents';
 
 function Voting() {
   const { authToken, handleLogout } = useAuth();
   const navigate = useNavigate();
   const [votes, setVotes] = useState({});
-  const [myVotes, setMyVotes] = useState([]);
+  const [myVotes, setMyVotes] = useState({});
   const [currentYear, setCurrentYear] = useState(new Date().getFullYear());
 
   const API_BASE_URL = 'http://localhost:8000';
@@ -24,9 +25,9 @@ function Voting() {
     return fridays;
   };
 
-  const fetchVotes = async (month) => {
+  const fetchSummary = async (month) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/votes/${month}`, {
+      const response = await fetch(`${API_BASE_URL}/votes/${month}/summary`, {
         headers: {
           'Authorization': `Bearer ${authToken}`,
         },
@@ -34,33 +35,12 @@ function Voting() {
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
+      // Per-date counts and the user's own selections, tallied by the server
       const data = await response.json();
-      const voteCounts = data.reduce((acc, vote) => {
-        acc[vote.event_date] = (acc[vote.event_date] || 0) + 1;
-        return acc;
-      }, {});
-      setVotes(prevVotes => ({ ...prevVotes, [month]: voteCounts }));
+      setVotes(prevVotes => ({ ...prevVotes, [month]: data.counts }));
+      setMyVotes(prevMyVotes => ({ ...prevMyVotes, [month]: data.my_votes }));
     } catch (error) {
-      console.error('Error fetching votes:', error);
-    }
-  };
-
-  const fetchMyVotes = async () => {
-    try {
-      const response = await fetch(`${API_BASE_URL}/votes/my-votes`,
-        {
-          headers: {
-            'Authorization': `Bearer ${authToken}`,
-          },
-        }
-      );
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-      const data = await response.json();
-      setMyVotes(data.map(vote => vote.event_date));
-    } catch (error) {
-      console.error("Error fetching user's votes:", error);
+      console.error('Error fetching vote summary:', error);
     }
   };
 
@@ -75,13 +55,14 @@ function Voting() {
     }
 
     // Optimistic UI update
-    const isCurrentlyVoted = myVotes.includes(eventDate);
-    const previousMyVotes = [...myVotes]; // Save current state for potential rollback
+    const monthVotes = myVotes[month] || [];
+    const isCurrentlyVoted = monthVotes.includes(eventDate);
+    const previousMyVotes = { ...myVotes }; // Save current state for potential rollback
 
     if (isCurrentlyVoted) {
-      setMyVotes(myVotes.filter(date => date !== eventDate));
+      setMyVotes({ ...myVotes, [month]: monthVotes.filter(date => date !== eventDate) });
     } else {
-      setMyVotes([...myVotes, eventDate]);
+      setMyVotes({ ...myVotes, [month]: [...monthVotes, eventDate] });
     }
 
     try {
@@ -104,9 +85,7 @@ function Voting() {
         setMyVotes(previousMyVotes);
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      // After successful API call, re-fetch to ensure consistency (especially for vote counts)
-      fetchVotes(month);
-      // fetchMyVotes(); // No longer strictly needed for myVotes, but good for consistency
+      // The new vote count arrives as a 'vote' event, no refetch needed
     } catch (error) {
       console.error('Error casting vote:', error);
       // If API call fails, revert UI
@@ -122,10 +101,24 @@ function Voting() {
   ];
 
   useEffect(() => {
-    months.forEach(month => fetchVotes(month.name));
-    fetchMyVotes();
+    months.forEach(month => fetchSummary(month.name));
   }, []);
 
+  // Live vote counts pushed by the server
+  useEffect(() => {
+    if (!authToken) {
+      return undefined;
+    }
+    const refetch = () => months.forEach(month => fetchSummary(month.name));
+    return subscribeToEvents(API_BASE_URL, authToken, {
+      vote: (event) => {
+        const { month, event_date, count } = JSON.parse(event.data);
+        setVotes(prevVotes => ({ ...prevVotes, [month]: { ...prevVotes[month], [event_date]: count } }));
+      },
+      resync: refetch,
+    }, refetch);
+  }, [authToken]);
+
   return (
     <div className="voting-container">
       <h2>Vote for the Gathering Date</h2>
@@ -141,7 +134,7 @@ function Voting() {
                   const dateString = friday.toDateString();
                   const count = votes[month.name]?.[dateString] || 0;
                   const percentage = totalVotes > 0 ? ((count / totalVotes) * 100).toFixed(2) : 0;
-                  const isVoted = myVotes.includes(dateString);
+                  const isVoted = (myVotes[month.name] || []).includes(dateString);
                   return (
                     <li key={dateString} className="friday-item">
                       <div className="friday-info">
@@ -0,0 +1,62 @@
+// Subscribe to the server-sent events stream (GET /events). EventSource cannot send an Authorization
+// header, so each connection first fetches a short-lived ticket and passes that in the URL. The
+// server ends every stream after a while; the connection is then reopened with a new ticket and
+// onReconnect is called, since events may have been missed in between. Returns a cleanup function.
+const RECONNECT_DELAY_MS = 3000;
+
+export function subscribeToEvents(apiBaseUrl, authToken, listeners, onReconnect) {
+  let source = null;
+  let timer = null;
+  let closed = false;
+  let connected = false;
+
+  const reconnect = () => {
+    if (source) {
+      source.close();
+      source = null;
+    }
+    if (!closed) {
+      timer = setTimeout(connect, RECONNECT_DELAY_MS);
+    }
+  };
+
+  const connect = async () => {
+    try {
+      const response = await fetch(`${apiBaseUrl}/events/ticket`, {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${authToken}`,
+        },
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const { ticket } = await response.json();
+      if (closed) {
+        return;
+      }
+      source = new EventSource(`${apiBaseUrl}/events?ticket=${encodeURIComponent(ticket)}`);
+      Object.entries(listeners).forEach(([type, listener]) => source.addEventListener(type, listener));
+      source.addEventListener('open', () => {
+        if (connected && onReconnect) {
+          onReconnect();
+        }
+        connected = true;
+      });
+      // Also fired when the server ends the stream: the ticket has expired, so reconnect with a new one
+      source.addEventListener('error', reconnect);
+    } catch (error) {
+      console.error('Error connecting to live updates:', error);
+      reconnect();
+    }
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(timer);
+    if (source) {
+      source.close();
+    }
+  };
+}